@@ -22,14 +22,43 @@ from lib.config import (
     FINE_TUNING_SUFFIX,
     FINE_TUNING_HYPERPARAMETERS
 )
+from lib.api_utils import retry_openai
 
 # Load environment variables
 load_dotenv()
 
+# Status polling intervals: (seconds since last status change, seconds between checks)
+POLL_INTERVALS = [
+    (120, 10),
+    (600, 30),
+    (1800, 60),
+]
+MAX_POLL_INTERVAL = 120
 
+
+def get_poll_interval(elapsed: float) -> int:
+    """
+    Get how long to wait before the next status check.
+
+    Polls quickly right after a status change and backs off the longer
+    nothing happens, since jobs spend most of their time running.
+
+    Args:
+        elapsed: Seconds since the job's status last changed
+
+    Returns:
+        Seconds to wait before polling again
+    """
+    for threshold, interval in POLL_INTERVALS:
+        if elapsed < threshold:
+            return interval
+    return MAX_POLL_INTERVAL
+
+
+@retry_openai()
 def upload_file(client: OpenAI, filepath: str, purpose: str) -> str:
     """
-    Upload a file to OpenAI.
+    Upload a file to OpenAI, retrying on transient API errors.
 
     Args:
         client: OpenAI client instance
@@ -50,6 +79,9 @@ def create_fine_tuning_job(client: OpenAI, training_file_id: str, validation_fil
     """
     Create a fine-tuning job.
 
+    Not retried: job creation is a billed, non-idempotent request, and a
+    retry after a timeout could start a second training job.
+
     Args:
         client: OpenAI client instance
         training_file_id: ID of uploaded training file
@@ -78,6 +110,12 @@ def create_fine_tuning_job(client: OpenAI, training_file_id: str, validation_fil
     return response.id
 
 
+@retry_openai()
+def retrieve_job(client: OpenAI, job_id: str):
+    """Retrieve a fine-tuning job, retrying on transient API errors."""
+    return client.fine_tuning.jobs.retrieve(job_id)
+
+
 def monitor_job(client: OpenAI, job_id: str):
     """
     Monitor a fine-tuning job until completion.
@@ -96,11 +134,13 @@ def monitor_job(client: OpenAI, job_id: str):
     print()
 
     last_status = None
+    last_change = time.monotonic()
     while True:
-        job = client.fine_tuning.jobs.retrieve(job_id)
+        job = retrieve_job(client, job_id)
         status = job.status
 
         if status != last_status:
+            last_change = time.monotonic()
             print(f"[{time.strftime('%H:%M:%S')}] Status: {status}")
 
             # Show additional info when available
@@ -114,7 +154,7 @@ def monitor_job(client: OpenAI, job_id: str):
             break
 
         # Wait before checking again
-        time.sleep(30)
+        time.sleep(get_poll_interval(time.monotonic() - last_change))
 
     print()
     print("=" * 60)
@@ -175,7 +215,8 @@ def main():
 
     # Initialize OpenAI client
     try:
-        client = OpenAI()
+        # retry_openai is the retry policy, so turn off the SDK's own retries
+        client = OpenAI(max_retries=0)
     except Exception as e:
         print(f"Error initializing OpenAI client: {e}")
         print()
@@ -0,0 +1,96 @@
+"""
+Helpers for calling the OpenAI API reliably: retries and client-side throttling.
+"""
+
+import functools
+import random
+import threading
+import time
+
+
+@functools.cache
+def retryable_errors() -> tuple[type[Exception], ...]:
+    """
+    Errors worth retrying: rate limits, network problems (including timeouts) and 5xx responses.
+
+    Resolved on first use so importing this module doesn't load the OpenAI SDK.
+    """
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+    return (RateLimitError, APIConnectionError, InternalServerError)
+
+
+def retry_openai(max_attempts: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+    """
+    Decorator that retries OpenAI calls on transient errors.
+
+    Waits base_delay * 2**attempt seconds (plus random jitter, capped at
+    max_delay) between attempts and re-raises the last error once
+    max_attempts is reached.
+
+    Args:
+        max_attempts: Total number of attempts, including the first call
+        base_delay: Delay in seconds before the first retry
+        max_delay: Maximum delay in seconds between retries
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            errors = retryable_errors()
+            for attempt in range(max_attempts):
+                try:
+                    return func(*args, **kwargs)
+                except errors:
+                    if attempt == max_attempts - 1:
+                        raise
+                    delay = min(max_delay, base_delay * 2 ** attempt)
+                    time.sleep(delay + random.uniform(0, delay))
+        return wrapper
+    return decorator
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket for requests and tokens per minute.
+
+    Capacity refills continuously, so callers are spread out evenly instead
+    of bursting into OpenAI's rate limits and waiting on 429 errors.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.max_requests = requests_per_minute
+        self.max_tokens = tokens_per_minute
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        self.available_requests = min(self.max_requests, self.available_requests + self.max_requests * elapsed / 60)
+        self.available_tokens = min(self.max_tokens, self.available_tokens + self.max_tokens * elapsed / 60)
+
+    def acquire(self, tokens: int = 0):
+        """
+        Block until there is capacity for one request using the given number of tokens.
+
+        Args:
+            tokens: Estimated tokens the request will consume
+        """
+        # A single request larger than the whole bucket would never fit
+        tokens = min(tokens, self.max_tokens)
+
+        while True:
+            with self.lock:
+                self._refill()
+                if self.available_requests >= 1 and self.available_tokens >= tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= tokens
+                    return
+                # Sleep roughly until enough capacity has refilled
+                wait = max(
+                    (1 - self.available_requests) * 60 / self.max_requests,
+                    (tokens - self.available_tokens) * 60 / self.max_tokens,
+                )
+            time.sleep(max(wait, 0.01))
@@ -0,0 +1,175 @@
+"""
+Helpers for OpenAI's Batch API.
+
+Batch jobs are processed asynchronously (within a 24h window) at half the
+price of regular requests, which suits one-off bulk work such as enhancing
+thousands of generic prompts.
+"""
+
+import json
+import time
+from typing import TYPE_CHECKING
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+from lib.config import BATCH_API_COMPLETION_WINDOW
+from lib.api_utils import retry_openai, retryable_errors
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def build_chat_request(custom_id: str, body: dict) -> dict:
+    """
+    Build a single Batch API request line for the chat completions endpoint.
+
+    Args:
+        custom_id: Unique ID used to match the result back to the request
+        body: Chat completion parameters (model, messages, ...)
+
+    Returns:
+        Request dictionary in Batch API input format
+    """
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": body,
+    }
+
+
+@retry_openai()
+def _upload_batch_input(client: "OpenAI", payload: bytes) -> str:
+    """Upload a Batch API input file and return its ID."""
+    return client.files.create(file=("batch_input.jsonl", payload), purpose="batch").id
+
+
+@retry_openai()
+def _create_batch(client: "OpenAI", input_file_id: str, completion_window: str) -> str:
+    """Start a batch job for an uploaded input file and return its ID."""
+    batch = client.batches.create(
+        input_file_id=input_file_id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=completion_window,
+    )
+    return batch.id
+
+
+@retry_openai()
+def retrieve_batch(client: "OpenAI", batch_id: str):
+    """
+    Fetch the current state of a batch job, retrying on transient API errors.
+
+    Args:
+        client: OpenAI client instance
+        batch_id: Batch job ID
+
+    Returns:
+        Batch object
+    """
+    return client.batches.retrieve(batch_id)
+
+
+def submit_batch(client: "OpenAI", requests: list[dict], completion_window: str = BATCH_API_COMPLETION_WINDOW) -> str:
+    """
+    Upload batch requests and start a batch job.
+
+    Each API call is retried on transient errors.
+
+    Args:
+        client: OpenAI client instance
+        requests: List of requests built with build_chat_request
+        completion_window: Time frame within which the batch should be processed
+
+    Returns:
+        Batch job ID
+    """
+    if orjson:
+        payload = b"".join(orjson.dumps(r) + b"\n" for r in requests)
+    else:
+        payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in requests).encode("utf-8")
+    input_file_id = _upload_batch_input(client, payload)
+    return _create_batch(client, input_file_id, completion_window)
+
+
+def wait_for_batch(client: "OpenAI", batch_id: str, poll_interval: float = 10, max_interval: float = 120,
+                   verbose: bool = True):
+    """
+    Poll a batch job until it reaches a terminal status.
+
+    The polling interval starts at poll_interval seconds and grows by 1.5x
+    after each check (capped at max_interval), so long-running batches don't
+    waste API calls. Status checks that still fail after retrying are
+    skipped until the next poll, so a transient outage doesn't abandon a
+    running batch.
+
+    Args:
+        client: OpenAI client instance
+        batch_id: Batch job ID
+        poll_interval: Initial seconds between status checks
+        max_interval: Maximum seconds between status checks
+        verbose: Whether to print progress messages
+
+    Returns:
+        The final Batch object
+    """
+    interval = poll_interval
+    last_status = None
+
+    while True:
+        try:
+            batch = retrieve_batch(client, batch_id)
+        except retryable_errors() as e:
+            if verbose:
+                print(f"  [{time.strftime('%H:%M:%S')}] Status check failed ({e}), retrying in {interval:.0f}s")
+            time.sleep(interval)
+            continue
+
+        if verbose and batch.status != last_status:
+            counts = batch.request_counts
+            progress = f" ({counts.completed}/{counts.total} requests)" if counts else ""
+            print(f"  [{time.strftime('%H:%M:%S')}] Batch status: {batch.status}{progress}")
+            last_status = batch.status
+
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            return batch
+
+        time.sleep(interval)
+        interval = min(max_interval, interval * 1.5)
+
+
+@retry_openai()
+def download_batch_results(client: "OpenAI", batch) -> dict[str, str]:
+    """
+    Download the output of a finished batch job, retrying on transient API errors.
+
+    Args:
+        client: OpenAI client instance
+        batch: Batch object returned by wait_for_batch
+
+    Returns:
+        Dictionary mapping custom_id to the assistant's message content.
+        Requests that failed are left out.
+    """
+    if not batch.output_file_id:
+        return {}
+
+    results = {}
+    content = client.files.content(batch.output_file_id)
+
+    for line in content.text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            continue
+        results[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+    return results
@@ -6,18 +6,34 @@ Shared configuration for Email Writer
 FINETUNING_BASE_MODEL = "gpt-4o-mini-2024-07-18"  # Base model for fine-tuning
 PROMPT_ENHANCER_MODEL = "gpt-4o-mini"  # Model used to enhance generic prompts
 PROMPT_ENHANCEMENT_BATCH_SIZE = 10  # Number of prompts to process per API call
+PROMPT_ENHANCEMENT_MAX_CONCURRENCY = 10  # API calls in flight at once
+PROMPT_ENHANCEMENT_REQUESTS_PER_MINUTE = 500  # Client-side throttle (gpt-4o-mini tier 1 limit)
+PROMPT_ENHANCEMENT_TOKENS_PER_MINUTE = 200000  # Client-side throttle (gpt-4o-mini tier 1 limit)
+GENERATION_REQUESTS_PER_MINUTE = 500  # Client-side throttle for test generations in the web UI
+GENERATION_TOKENS_PER_MINUTE = 200000  # Client-side throttle for test generations in the web UI
+GENERATION_MAX_CONCURRENCY = 10  # Test generations in flight at once in the web UI
+GENERATION_MAX_TOKENS = 500  # Maximum tokens per generated test email
+GENERATION_TEMPERATURE = 0.7  # Sampling temperature for test generations
+
+# OpenAI Batch API settings (optional, half price but asynchronous)
+BATCH_API_COMPLETION_WINDOW = "24h"  # Only window currently supported by OpenAI
+BATCH_API_DISCOUNT = 0.5  # Batch requests cost 50% of regular requests
 
 # Data preparation settings
 VALIDATION_SPLIT_RATIO = 0.1  # 10% of data for validation
 MIN_TRAINING_EXAMPLES = 10  # Minimum examples required by OpenAI
 MAX_TRAINING_EXAMPLES = 10000  # Cap to limit training time  
 
+# Email processing settings
+MBOX_PROCESSING_WORKERS = None  # Processes used to clean emails (None = all CPU cores)
+
 # Email filtering settings
-GENERIC_PROMPTS = {
+# Stored stripped and lowercased to match how user prompts are normalized before lookup
+GENERIC_PROMPTS = frozenset(p.strip().lower() for p in (
     "write an email in your tone",
     "write an email in your tone.",
     "write an email with your tone",
-}
+))
 
 # Output file names
 TRAINING_FILE = "training.jsonl"
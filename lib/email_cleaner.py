@@ -2,10 +2,123 @@
 Email cleaning and extraction logic for Gmail .mbox files
 """
 
-import mailbox
+import mmap
+import os
 import re
+from collections import deque
+from itertools import islice
+from email.parser import BytesParser, BytesHeaderParser
+import multiprocessing
 from bs4 import BeautifulSoup
-from lib.config import GENERIC_PROMPTS
+from lib.config import GENERIC_PROMPTS, MBOX_PROCESSING_WORKERS
+
+# Regular expressions are compiled once at import time since the cleaning
+# and filtering functions below run for every message in the mailbox.
+_RE_HTML_TAG = re.compile(r'<[^>]+>')
+_RE_EXTRA_BLANK_LINES = re.compile(r'\n\s*\n\s*\n+')
+_RE_WROTE = re.compile(r"On .+?wrote:", re.DOTALL)
+_RE_TRAILING_ON_DATE = re.compile(r"\n\s*On\s+\w+,")
+_RE_SENT_FROM = re.compile(r"Sent from my .+")
+_RE_OUTLOOK_SEPARATOR = re.compile(r'_{20,}')
+# Every line boundary recognized by str.splitlines(), so bodies can be
+# normalized to \n before line-based regexes run
+_RE_LINE_BREAK = re.compile('\r\n|[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+_RE_QUOTED_LINE = re.compile(r'^[^\S\n]*>.*\n?', re.MULTILINE)
+_RE_METADATA_LINE = re.compile(
+    r'^(?:'
+    r'(?:From|Sent|To|Subject|Cc|Bcc):.*'  # Header lines
+    r'|.*email originated from an external sender.*'  # Caution warnings
+    r'|.*do not click links.*'
+    r'|[^\S\n]*⚠.*'  # Warning symbols
+    r')\n?',
+    re.MULTILINE | re.IGNORECASE
+)
+_RE_URL_ONLY = re.compile(r'^https?://\S+$')
+_RE_URL = re.compile(r'https?://\S+')
+_RE_PHONE = re.compile(r'\d{3}[-.\s]?\d{3}[-.\s]?\d{4}')
+_RE_EMAIL = re.compile(r'\S+@\S+')
+_RE_IMAGE_REF = re.compile(r'\[image:.*?\]', re.IGNORECASE)
+_RE_EMOJI_ONLY = re.compile(r"[^\w\s]+")
+
+_AUTO_GENERATED_PHRASES = (
+    "automatically generated",
+    "do not reply",
+    "this is an automated",
+)
+
+_TEST_PHRASES = ("test forward", "test redirect", "test email")
+
+# Each filter's patterns are combined into one alternation, so a single
+# scan of the body decides the filter instead of one scan per pattern
+_RE_CONFIRMATION = re.compile("|".join((
+    r'confirmation\s*#',
+    r'order\s*#',
+    r'tracking\s*number',
+    r'flight\s*#',
+)), re.IGNORECASE)
+
+_RE_CODE = re.compile("|".join((
+    r'\{[\s\n]*[\w-]+\s*:\s*[\w-]+\s*;',  # CSS properties like { color: red; }
+    r'#[\w_-]+\s*\{',  # CSS ID selectors
+    r'\.[\w_-]+\s*\{',  # CSS class selectors
+    r'function\s*\(',  # JavaScript function
+    r'var\s+\w+\s*=',  # JavaScript var
+    r'const\s+\w+\s*=',  # JavaScript const
+)))
+
+_RE_MEETING = re.compile("|".join((
+    r'join\s+zoom\s+meeting',
+    r'meeting\s+id:\s*\d+',
+    r'passcode:\s*\d+',
+    r'dial\s+by\s+your\s+location',
+    r'join\s+teams\s+meeting',
+    r'google\s+meet',
+    r'one\s+tap\s+mobile',
+)), re.IGNORECASE)
+
+_RE_HEADERS = re.compile("|".join((
+    r'^From:\s+\S+',
+    r'^Sent:\s+\w+,',
+    r'^To:\s+\S+',
+    r'^Subject:\s+.+',
+    r'email originated from an external sender',
+    r'________________________________',  # Outlook separator
+)), re.MULTILINE | re.IGNORECASE)
+
+# Each form field is its own capture group inside a lookahead, so every
+# position is checked and match.lastindex tells which field was found
+_RE_FORM_FIELD = re.compile("(?=" + "|".join(f"({p})" for p in (
+    r'account:\s*\w+',
+    r'username:\s*\w+',
+    r'balance:\s*\$\d+',
+    r'user\s+id:\s*\d+',
+    r'password:\s*\w+',
+)) + ")", re.IGNORECASE)
+
+# "From " separator lines between messages in an mbox file
+_RE_MBOX_SEPARATOR = re.compile(rb'^From ', re.MULTILINE)
+
+
+def _decode_part(part):
+    """Decode a MIME part's payload to text, or return None if it can't be decoded."""
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return None
+
+    try:
+        charset = part.get_content_charset() or "utf-8"
+        return payload.decode(charset, errors="replace")
+    except:
+        return None
+
+
+def _html_to_text(html):
+    """Extract the visible text from an HTML document."""
+    soup = BeautifulSoup(html, "lxml")
+    # Remove script and style elements
+    for script in soup(["script", "style"]):
+        script.decompose()
+    return soup.get_text("\n")
 
 
 def extract_clean_text(msg):
@@ -17,32 +130,29 @@ def extract_clean_text(msg):
     html_part = None
 
     if msg.is_multipart():
-        for part in msg.walk():
-            ctype = part.get_content_type()
-            disp = part.get("Content-Disposition", "")
-
-            if "attachment" in disp:
-                continue
-
-            payload = part.get_payload(decode=True)
-            if payload is None:
-                continue
-
-            try:
-                charset = part.get_content_charset() or "utf-8"
-                decoded = payload.decode(charset, errors="replace")
-            except:
-                continue
-
-            if ctype == "text/plain" and not text_part:
-                text_part = decoded
-
-            elif ctype == "text/html" and not html_part:
-                soup = BeautifulSoup(decoded, "html.parser")
-                # Remove script and style elements
-                for script in soup(["script", "style"]):
-                    script.decompose()
-                html_part = soup.get_text("\n")
+        parts = [
+            part for part in msg.walk()
+            if "attachment" not in part.get("Content-Disposition", "")
+        ]
+
+        # Look for text/plain first and stop at the first non-empty one
+        for part in parts:
+            if part.get_content_type() == "text/plain":
+                text_part = _decode_part(part)
+                if text_part:
+                    break
+
+        # HTML parsing is the most expensive step, so only do it when
+        # there is no plain text version of the email
+        if not text_part:
+            for part in parts:
+                if part.get_content_type() == "text/html":
+                    decoded = _decode_part(part)
+                    if decoded is None:
+                        continue
+                    html_part = _html_to_text(decoded)
+                    if html_part:
+                        break
 
     else:
         payload = msg.get_payload(decode=True)
@@ -50,12 +160,11 @@ def extract_clean_text(msg):
             charset = msg.get_content_charset() or "utf-8"
             text_part = payload.decode(charset, errors="replace")
 
-    body = text_part or html_part or ""
-
-    # Final cleanup: remove any remaining HTML tags
-    body = re.sub(r'<[^>]+>', '', body)
+    # Final cleanup: remove any HTML tags left in the text. get_text() decodes
+    # entities, so HTML parts can contain tag-like text such as "<john@x.com>"
+    body = _RE_HTML_TAG.sub('', text_part or html_part or "")
     # Clean up excessive whitespace
-    body = re.sub(r'\n\s*\n\s*\n+', '\n\n', body)
+    body = _RE_EXTRA_BLANK_LINES.sub('\n\n', body)
 
     return body.strip()
 
@@ -63,11 +172,12 @@ def extract_clean_text(msg):
 def strip_quoted(body):
     """Remove quoted text from email replies."""
     # Remove quoted lines
-    body = "\n".join([ln for ln in body.splitlines() if not ln.strip().startswith(">")])
+    body = _RE_LINE_BREAK.sub("\n", body)
+    body = _RE_QUOTED_LINE.sub("", body)
     # Remove Gmail "On Tue, X wrote:" - more aggressive pattern
-    body = re.split(r"On .+?wrote:", body, flags=re.DOTALL)[0]
+    body = _RE_WROTE.split(body, maxsplit=1)[0]
     # Remove trailing quoted sections that start with "On [date]"
-    body = re.split(r"\n\s*On\s+\w+,", body)[0]
+    body = _RE_TRAILING_ON_DATE.split(body, maxsplit=1)[0]
     return body.strip()
 
 
@@ -77,34 +187,19 @@ def strip_signature(body):
     if "--" in body:
         body = body.split("--", 1)[0]
     # Remove "Sent from my iPhone"
-    body = re.sub(r"Sent from my .+", "", body)
+    body = _RE_SENT_FROM.sub("", body)
     return body.strip()
 
 
 def strip_email_metadata(body):
     """Remove email headers and metadata that leak through."""
     # Remove Outlook separators
-    body = re.sub(r'_{20,}', '', body)
+    body = _RE_OUTLOOK_SEPARATOR.sub('', body)
 
-    # Remove "From:", "Sent:", "To:", "Subject:" headers
-    lines = body.splitlines()
-    cleaned_lines = []
-
-    for line in lines:
-        # Skip header lines
-        if re.match(r'^(From|Sent|To|Subject|Cc|Bcc):\s*', line, re.IGNORECASE):
-            continue
-        # Skip caution warnings
-        if 'email originated from an external sender' in line.lower():
-            continue
-        if 'do not click links' in line.lower():
-            continue
-        # Skip warning symbols
-        if line.strip().startswith('⚠'):
-            continue
-        cleaned_lines.append(line)
-
-    body = '\n'.join(cleaned_lines)
+    # Remove "From:", "Sent:", "To:", "Subject:" headers, caution warnings
+    # and warning symbol lines
+    body = _RE_LINE_BREAK.sub('\n', body)
+    body = _RE_METADATA_LINE.sub('', body)
     return body.strip()
 
 
@@ -114,155 +209,128 @@ def strip_email_metadata(body):
 
 def is_url_only(body):
     """Filter out URL-only emails or emails with just a URL and minimal context."""
-    stripped = body.strip()
+    # Neither check below can match without a URL
+    if 'http' not in body:
+        return False
+
     # Pure URL
-    url_pattern = r'^https?://\S+$'
-    if re.match(url_pattern, stripped):
+    if _RE_URL_ONLY.match(body.strip()):
         return True
 
     # URL with minimal text (less than 10 words excluding the URL)
-    text_without_urls = re.sub(r'https?://\S+', '', body)
-    if len(text_without_urls.split()) < 10 and 'http' in body:
-        return True
-
-    return False
+    text_without_urls = _RE_URL.sub('', body)
+    return len(text_without_urls.split()) < 10
 
 
-def is_auto_generated(body):
+def is_auto_generated(body, body_lower=None):
     """Filter auto-generated messages."""
-    patterns = [
-        "automatically generated",
-        "do not reply",
-        "this is an automated"
-    ]
-    return any(p in body.lower() for p in patterns)
+    if body_lower is None:
+        body_lower = body.lower()
+    return any(p in body_lower for p in _AUTO_GENERATED_PHRASES)
 
 
-def is_test_message(body, subject):
+def is_test_message(body, subject, body_lower=None):
     """Filter test messages."""
-    test_patterns = ["test forward", "test redirect", "test email"]
-    combined = (body + " " + subject).lower()
-    return any(p in combined for p in test_patterns)
+    if body_lower is None:
+        body_lower = body.lower()
+    combined = body_lower + " " + subject.lower()
+    return any(p in combined for p in _TEST_PHRASES)
 
 
-def is_signature_only(body):
+def is_signature_only(body, word_count=None):
     """Filter signature-only emails (just name/phone/email)."""
-    if len(body.split()) < 10:
-        phone_pattern = r'\d{3}[-.\s]?\d{3}[-.\s]?\d{4}'
-        email_pattern = r'\S+@\S+'
-        return bool(re.search(phone_pattern, body) or re.search(email_pattern, body))
+    if word_count is None:
+        word_count = len(body.split())
+    if word_count < 10:
+        return bool(_RE_PHONE.search(body) or _RE_EMAIL.search(body))
     return False
 
 
 def is_confirmation_email(body):
     """Filter confirmation/tracking emails."""
-    patterns = [
-        r'confirmation\s*#',
-        r'order\s*#',
-        r'tracking\s*number',
-        r'flight\s*#'
-    ]
-    return any(re.search(p, body, re.IGNORECASE) for p in patterns)
+    return _RE_CONFIRMATION.search(body) is not None
 
 
-def has_only_image_refs(body):
+def has_only_image_refs(body, body_lower=None):
     """Filter emails with only image references."""
-    if '[image:' in body.lower() or 'image.png' in body.lower():
-        text_without_images = re.sub(r'\[image:.*?\]', '', body, flags=re.IGNORECASE)
+    if body_lower is None:
+        body_lower = body.lower()
+    if '[image:' in body_lower or 'image.png' in body_lower:
+        text_without_images = _RE_IMAGE_REF.sub('', body)
         return len(text_without_images.split()) < 5
     return False
 
 
 def has_code_or_css(body):
     """Filter emails containing CSS or JavaScript code."""
-    code_patterns = [
-        r'\{[\s\n]*[\w-]+\s*:\s*[\w-]+\s*;',  # CSS properties like { color: red; }
-        r'#[\w_-]+\s*\{',  # CSS ID selectors
-        r'\.[\w_-]+\s*\{',  # CSS class selectors
-        r'function\s*\(',  # JavaScript function
-        r'var\s+\w+\s*=',  # JavaScript var
-        r'const\s+\w+\s*=',  # JavaScript const
-    ]
-    return any(re.search(pattern, body) for pattern in code_patterns)
+    return _RE_CODE.search(body) is not None
 
 
 def is_meeting_invite(body):
     """Filter meeting invite details (Zoom, Teams, etc.)."""
-    meeting_patterns = [
-        r'join\s+zoom\s+meeting',
-        r'meeting\s+id:\s*\d+',
-        r'passcode:\s*\d+',
-        r'dial\s+by\s+your\s+location',
-        r'join\s+teams\s+meeting',
-        r'google\s+meet',
-        r'one\s+tap\s+mobile',
-    ]
-    return any(re.search(pattern, body, re.IGNORECASE) for pattern in meeting_patterns)
+    return _RE_MEETING.search(body) is not None
 
 
 def has_email_headers(body):
     """Filter emails with metadata headers leaked through."""
-    header_patterns = [
-        r'^From:\s+\S+',
-        r'^Sent:\s+\w+,',
-        r'^To:\s+\S+',
-        r'^Subject:\s+.+',
-        r'email originated from an external sender',
-        r'________________________________',  # Outlook separator
-    ]
-    return any(re.search(pattern, body, re.MULTILINE | re.IGNORECASE) for pattern in header_patterns)
+    return _RE_HEADERS.search(body) is not None
 
 
 def has_form_data(body):
     """Filter emails with account/form data patterns."""
-    form_patterns = [
-        r'account:\s*\w+',
-        r'username:\s*\w+',
-        r'balance:\s*\$\d+',
-        r'user\s+id:\s*\d+',
-        r'password:\s*\w+',
-    ]
     # Check if multiple form-like patterns exist
-    matches = sum(1 for pattern in form_patterns if re.search(pattern, body, re.IGNORECASE))
-    return matches >= 2  # If 2+ form fields, likely form data
+    fields_found = set()
+    for match in _RE_FORM_FIELD.finditer(body):
+        fields_found.add(match.lastindex)
+        if len(fields_found) >= 2:  # If 2+ form fields, likely form data
+            return True
+    return False
 
 
-def is_meaningful(body, subject=""):
+def is_meaningful(body, subject="", *, body_lower=None, word_count=None):
     """
     Check if an email body is meaningful and worth including in training data.
     Returns True if the email should be kept, False if it should be filtered out.
+
+    The lowercase body and word count are computed once (or taken from the
+    caller) and shared by the filters, which run cheapest first so most
+    rejects skip the regex scans.
     """
-    if not body.strip():
+    stripped = body.strip()
+    if not stripped:
         return False
     # Skip pure emoji reactions, e.g. ❤️ or 👍
-    if re.fullmatch(r"[^\w\s]+", body.strip()):
+    if _RE_EMOJI_ONLY.fullmatch(stripped):
         return False
     # Skip Gmail auto "reacted via Gmail"
     if "reacted via Gmail" in body:
         return False
+
+    if body_lower is None:
+        body_lower = body.lower()
+    if word_count is None:
+        word_count = len(body.split())
+
     # Skip single-word "unsubscribe" messages
-    if body.strip().lower() == "unsubscribe":
-        return False
-    # Skip URL-only emails
-    if is_url_only(body):
+    if body_lower.strip() == "unsubscribe":
         return False
     # Skip auto-generated messages
-    if is_auto_generated(body):
+    if is_auto_generated(body, body_lower):
         return False
     # Skip test messages
-    if is_test_message(body, subject):
+    if is_test_message(body, subject, body_lower):
         return False
     # Skip signature-only emails
-    if is_signature_only(body):
+    if is_signature_only(body, word_count):
         return False
-    # Skip confirmation emails
-    if is_confirmation_email(body):
+    # Skip URL-only emails
+    if is_url_only(body):
         return False
     # Skip image-only references
-    if has_only_image_refs(body):
+    if has_only_image_refs(body, body_lower):
         return False
-    # Skip code/CSS
-    if has_code_or_css(body):
+    # Skip confirmation emails
+    if is_confirmation_email(body):
         return False
     # Skip meeting invites
     if is_meeting_invite(body):
@@ -273,10 +341,13 @@ def is_meaningful(body, subject=""):
     # Skip form data
     if has_form_data(body):
         return False
+    # Skip code/CSS
+    if has_code_or_css(body):
+        return False
     return True
 
 
-def intent_from_subject_or_body(subject, body):
+def intent_from_subject_or_body(subject, body, word_count=None):
     """Generate a synthetic intent prompt for non-reply emails."""
     s = subject.lower().strip()
     b = body.lower().strip()
@@ -290,74 +361,260 @@ def intent_from_subject_or_body(subject, body):
     if s.startswith("fwd:") or s.startswith("fw:"):
         return "Write a forwarded message."
 
-    if len(body.split()) <= 4:
+    if word_count is None:
+        word_count = len(body.split())
+    if word_count <= 4:
         return "Write a brief one-line email in your tone."
 
     return "Write an email in your tone."
 
 
-def process_mbox(mbox_path, user_email):
+def iter_raw_messages(mbox_path):
     """
-    Process an mbox file and extract sent emails into training examples.
+    Yield the raw bytes of each message in an mbox file.
+
+    Memory-maps the file and finds "From " separator lines with a regex,
+    rather than using mailbox.mbox, which builds a table of contents and
+    wraps every message in an mboxMessage. Only one message is copied out of
+    the map at a time, so memory use stays flat and the OS page cache decides
+    what stays resident. Like mailbox.mbox, the separator line itself and the
+    blank line before the next message are dropped.
+
+    Args:
+        mbox_path: Path to the .mbox file
+
+    Yields:
+        Raw message bytes (headers and body)
+    """
+    with open(mbox_path, "rb") as f:
+        # Empty files can't be memory-mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = None
+            for match in _RE_MBOX_SEPARATOR.finditer(mm):
+                if start is not None:
+                    yield _slice_message(mm, start, match.start())
+                start = match.start()
+
+            if start is not None:
+                yield _slice_message(mm, start, len(mm))
+
+
+def _slice_message(mm, start, end):
+    """Copy one message out of the map, skipping its separator line and trailing blank line."""
+    body_start = mm.find(b"\n", start, end) + 1 or end
+    if end - body_start >= 2 and mm[end - 2:end] == b"\n\n":
+        end -= 1
+    elif end - body_start == 1 and mm[body_start:end] == b"\n":
+        end = body_start
+    return mm[body_start:end]
+
+
+def find_reply_targets(mbox_path, user_email):
+    """
+    Collect the Message-IDs that the user's sent emails reply to.
+
+    Only message headers are parsed, so this pass is much cheaper than
+    cleaning every body.
 
     Args:
         mbox_path: Path to the .mbox file
         user_email: The user's email address (to identify sent messages)
 
     Returns:
-        List of training examples in OpenAI format
+        Set of In-Reply-To Message-IDs
     """
-    box = mailbox.mbox(mbox_path)
+    user_email = user_email.lower()
+    parser = BytesHeaderParser()
+    targets = set()
 
-    outbound = []
-    inbound = {}
+    for raw in iter_raw_messages(mbox_path):
+        headers = parser.parsebytes(raw)
+        if user_email in headers.get("From", "").lower():
+            inreply = headers.get("In-Reply-To", "").strip()
+            if inreply:
+                targets.add(inreply)
 
-    for msg in box:
-        msgid = msg.get("Message-ID", "").strip()
-        from_addr = msg.get("From", "").lower()
-        subject = msg.get("Subject", "")
+    return targets
 
-        body = extract_clean_text(msg)
-        body = strip_quoted(body)
-        body = strip_signature(body)
-        body = strip_email_metadata(body)
 
-        if not is_meaningful(body, subject):
+def clean_message(raw, user_email, reply_targets):
+    """
+    Parse, clean and filter a single raw message.
+
+    Args:
+        raw: Raw message bytes from iter_raw_messages
+        user_email: The user's email address (to identify sent messages)
+        reply_targets: Message-IDs of inbound emails worth keeping
+
+    Returns:
+        Tuple of (sent_by_user, msgid, inreply, subject, body, word_count), or
+        None if the message is filtered out
+    """
+    msg = BytesParser().parsebytes(raw)
+    msgid = msg.get("Message-ID", "").strip()
+    from_addr = msg.get("From", "").lower()
+    sent_by_user = user_email.lower() in from_addr
+
+    # Inbound emails are only needed if one of the user's emails replies to them
+    if not sent_by_user and msgid not in reply_targets:
+        return None
+
+    subject = msg.get("Subject", "")
+
+    body = extract_clean_text(msg)
+    body = strip_quoted(body)
+    body = strip_signature(body)
+    body = strip_email_metadata(body)
+
+    # Computed once here and reused by the filters and, for sent emails, the intent prompt
+    body_lower = body.lower()
+    word_count = len(body.split())
+
+    if not is_meaningful(body, subject, body_lower=body_lower, word_count=word_count):
+        return None
+
+    return sent_by_user, msgid, msg.get("In-Reply-To", "").strip(), subject, body, word_count
+
+
+# Messages sent to a cleaning worker per task
+CLEAN_CHUNK_SIZE = 64
+
+# Per-process arguments for clean_message, set once by the pool initializer
+# so the reply-target set isn't pickled along with every task
+_worker_args = ()
+
+
+def _init_worker(user_email, reply_targets):
+    global _worker_args
+    _worker_args = (user_email, reply_targets)
+
+
+def _clean_messages_in_worker(raws):
+    return [clean_message(raw, *_worker_args) for raw in raws]
+
+
+def clean_messages(mbox_path, user_email, reply_targets, workers=1):
+    """
+    Clean every message in an mbox file, optionally across several processes.
+
+    With several workers, messages are handed out in chunks of
+    CLEAN_CHUNK_SIZE and at most two chunks per worker are in flight, so
+    only a bounded window of raw messages is held in memory at once.
+
+    Args:
+        mbox_path: Path to the .mbox file
+        user_email: The user's email address (to identify sent messages)
+        reply_targets: Message-IDs of inbound emails worth keeping
+        workers: Number of worker processes (1 cleans in this process)
+
+    Yields:
+        clean_message results, in mbox order
+    """
+    raw_messages = iter_raw_messages(mbox_path)
+
+    if workers <= 1:
+        for raw in raw_messages:
+            yield clean_message(raw, user_email, reply_targets)
+        return
+
+    # Spawned workers start from a fresh interpreter; forking the threaded
+    # Streamlit server process could deadlock the children
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(user_email, reply_targets)) as pool:
+        pending = deque()
+
+        def submit_next_chunk():
+            chunk = list(islice(raw_messages, CLEAN_CHUNK_SIZE))
+            if chunk:
+                pending.append(pool.apply_async(_clean_messages_in_worker, (chunk,)))
+
+        for _ in range(2 * workers):
+            submit_next_chunk()
+
+        # Results are taken in submission order, which keeps mbox order for deduplication
+        while pending:
+            results = pending.popleft().get()
+            submit_next_chunk()
+            yield from results
+
+
+def iter_examples(mbox_path, user_email, workers=MBOX_PROCESSING_WORKERS):
+    """
+    Process an mbox file and yield training examples for sent emails.
+
+    Runs in two passes: the first collects which inbound messages are
+    replied to, the second cleans the user's emails and only those inbound
+    emails. Peak memory is bounded by the sent emails plus the emails they
+    reply to, rather than the whole mailbox. Cleaning is spread across
+    worker processes since it is CPU-bound and independent per message.
+
+    Args:
+        mbox_path: Path to the .mbox file
+        user_email: The user's email address (to identify sent messages)
+        workers: Number of worker processes (None uses every CPU core)
+
+    Yields:
+        Training examples in OpenAI format
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    reply_targets = find_reply_targets(mbox_path, user_email)
+
+    # Keyed by message-id to deduplicate (Gmail stores duplicates)
+    outbound = {}
+    inbound = {}
+
+    for result in clean_messages(mbox_path, user_email, reply_targets, workers):
+        if result is None:
             continue
 
+        sent_by_user, msgid, inreply, subject, body, word_count = result
+
         # SENT by you
-        if user_email.lower() in from_addr:
-            outbound.append({
-                "msgid": msgid,
-                "inreply": msg.get("In-Reply-To", "").strip(),
+        if sent_by_user:
+            outbound[msgid] = {
+                "inreply": inreply,
                 "subject": subject,
-                "body": body
-            })
+                "body": body,
+                "word_count": word_count
+            }
         else:
             inbound[msgid] = body
 
-    # Deduplicate outbound entries by message-id (Gmail stores duplicates)
-    unique_outbound = {o["msgid"]: o for o in outbound}.values()
-
-    dataset = []
-
-    for msg in unique_outbound:
+    for msg in outbound.values():
         if msg["inreply"] and msg["inreply"] in inbound:
             # Build reply example
-            dataset.append({
+            yield {
                 "messages": [
                     {"role": "user", "content": inbound[msg["inreply"]]},
                     {"role": "assistant", "content": msg["body"]}
                 ]
-            })
+            }
         else:
             # Outbound-only email → synthetic intent
-            intent = intent_from_subject_or_body(msg["subject"], msg["body"])
-            dataset.append({
+            intent = intent_from_subject_or_body(msg["subject"], msg["body"], msg["word_count"])
+            yield {
                 "messages": [
                     {"role": "user", "content": intent},
                     {"role": "assistant", "content": msg["body"]}
                 ]
-            })
+            }
+
+
+def process_mbox(mbox_path, user_email, workers=MBOX_PROCESSING_WORKERS):
+    """
+    Process an mbox file and extract sent emails into training examples.
 
-    return dataset
+    Args:
+        mbox_path: Path to the .mbox file
+        user_email: The user's email address (to identify sent messages)
+        workers: Number of worker processes (None uses every CPU core)
+
+    Returns:
+        List of training examples in OpenAI format
+    """
+    return list(iter_examples(mbox_path, user_email, workers))
@@ -3,18 +3,107 @@ Batch prompt enhancement using OpenAI API to convert generic prompts
 into context-aware, specific instructions.
 """
 
-import re
-from openai import OpenAI
-from lib.config import GENERIC_PROMPTS, PROMPT_ENHANCER_MODEL, PROMPT_ENHANCEMENT_BATCH_SIZE
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from lib.config import (
+    GENERIC_PROMPTS,
+    PROMPT_ENHANCER_MODEL,
+    PROMPT_ENHANCEMENT_BATCH_SIZE,
+    PROMPT_ENHANCEMENT_MAX_CONCURRENCY,
+    PROMPT_ENHANCEMENT_REQUESTS_PER_MINUTE,
+    PROMPT_ENHANCEMENT_TOKENS_PER_MINUTE
+)
+from lib.api_utils import RateLimiter, retry_openai
+from lib.batch_api import build_chat_request, submit_batch, wait_for_batch, download_batch_results
 
+if TYPE_CHECKING:
+    from openai import OpenAI
 
-def generate_specific_prompts_batch(client: OpenAI, email_bodies: list[str]) -> list[str]:
+# Used for any email the model didn't return a prompt for
+FALLBACK_PROMPT = "Write an email in your tone."
+
+
+def build_enhancement_instruction(email_bodies: list[str]) -> str:
+    """
+    Build the instruction asking the model to describe a batch of emails.
+
+    Args:
+        email_bodies: List of email bodies to generate prompts for
+
+    Returns:
+        Instruction text for a single chat completion request
+    """
+    # Truncate very long emails to avoid token limits
+    emails_text = "".join(
+        f"\n--- Email {i} ---\n{body[:1000]}\n"
+        for i, body in enumerate(email_bodies, 1)
+    )
+
+    return (
+        "For each email below, write a *concise instruction* describing its purpose. "
+        "One sentence only. No filler text. Return your answers as a JSON object with "
+        "a \"prompts\" list holding one entry per email, where \"id\" is the email number.\n\n"
+        "Example format:\n"
+        '{"prompts": [\n'
+        '  {"id": 1, "text": "Write an email asking for a meeting time."},\n'
+        '  {"id": 2, "text": "Write an email sharing a link with friends."},\n'
+        '  {"id": 3, "text": "Write a brief message confirming availability."}\n'
+        "]}\n\n"
+        f"Emails:{emails_text}\n"
+        "Return only the JSON object."
+    )
+
+
+def parse_enhanced_prompts(result_text: str, num_emails: int) -> list[str]:
+    """
+    Parse the model's JSON response into a list of prompts.
+
+    Prompts are matched to emails by id, so a missing or extra entry can't
+    shift the remaining prompts onto the wrong emails.
+
+    Args:
+        result_text: Raw JSON response text from the model (None for an
+            empty or refused response)
+        num_emails: Number of emails in the request
+
+    Returns:
+        List of num_emails prompts in input order. Emails without a valid
+        prompt get FALLBACK_PROMPT.
+    """
+    prompts = [FALLBACK_PROMPT] * num_emails
+
+    try:
+        entries = json.loads(result_text or "{}").get("prompts")
+    except (ValueError, AttributeError, TypeError):
+        return prompts
+
+    if not isinstance(entries, list):
+        return prompts
+
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        email_id, text = entry.get("id"), entry.get("text")
+        if isinstance(email_id, int) and 1 <= email_id <= num_emails and isinstance(text, str) and text.strip():
+            prompts[email_id - 1] = text.strip()
+
+    return prompts
+
+
+@retry_openai()
+def generate_specific_prompts_batch(client: "OpenAI", email_bodies: list[str],
+                                    rate_limiter: RateLimiter = None) -> list[str]:
     """
     Use the OpenAI API to generate specific prompts for multiple emails at once.
 
+    Transient API errors (rate limits, connection problems) are retried
+    with exponential backoff.
+
     Args:
         client: OpenAI client instance
         email_bodies: List of email bodies to generate prompts for
+        rate_limiter: Optional limiter shared between concurrent calls
 
     Returns:
         List of specific prompts in the same order as input
@@ -22,64 +111,104 @@ def generate_specific_prompts_batch(client: OpenAI, email_bodies: list[str]) ->
     if not email_bodies:
         return []
 
-    # Build the batched instruction
-    emails_text = ""
-    for i, body in enumerate(email_bodies, 1):
-        # Truncate very long emails to avoid token limits
-        truncated_body = body[:1000] if len(body) > 1000 else body
-        emails_text += f"\n--- Email {i} ---\n{truncated_body}\n"
+    instruction = build_enhancement_instruction(email_bodies)
 
-    instruction = (
-        "For each email below, write a *concise instruction* describing its purpose. "
-        "One sentence only. No filler text. Return your answers numbered, one per line.\n\n"
-        "Example format:\n"
-        "1. Write an email asking for a meeting time.\n"
-        "2. Write an email sharing a link with friends.\n"
-        "3. Write a brief message confirming availability.\n\n"
-        f"Emails:{emails_text}\n"
-        "Return only the numbered instructions, one per line."
-    )
+    if rate_limiter:
+        # ~4 characters per token for the input, plus ~30 tokens per generated prompt
+        rate_limiter.acquire(len(instruction) // 4 + 30 * len(email_bodies))
 
     response = client.chat.completions.create(
         model=PROMPT_ENHANCER_MODEL,
         messages=[{"role": "user", "content": instruction}],
+        response_format={"type": "json_object"},
     )
 
-    # Parse the numbered response
-    result_text = response.choices[0].message.content.strip()
-    lines = result_text.split('\n')
+    return parse_enhanced_prompts(response.choices[0].message.content, len(email_bodies))
 
-    prompts = []
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        # Remove leading number and dot/colon (e.g., "1. " or "1: ")
-        if line[0].isdigit():
-            # Find the first non-digit, non-punctuation character
-            for i, char in enumerate(line):
-                if char.isalpha():
-                    prompts.append(line[i:].strip())
-                    break
-        else:
-            prompts.append(line)
 
+def build_enhancement_requests(batches: list[list[str]]) -> list[dict]:
+    """
+    Build one Batch API request per batch of email bodies.
+
+    Args:
+        batches: Lists of email bodies, one list per request
+
+    Returns:
+        Requests with custom_ids gen-0, gen-1, ... in batch order
+    """
+    return [
+        build_chat_request(f"gen-{i}", {
+            "model": PROMPT_ENHANCER_MODEL,
+            "messages": [{"role": "user", "content": build_enhancement_instruction(batch)}],
+            "response_format": {"type": "json_object"},
+        })
+        for i, batch in enumerate(batches)
+    ]
+
+
+def parse_batch_results(results: dict[str, str], batches: list[list[str]], verbose: bool = True) -> list[str]:
+    """
+    Turn downloaded Batch API results into prompts aligned with the input.
+
+    Emails whose request failed, or that came back without a prompt, get
+    the default generic prompt.
+
+    Args:
+        results: Mapping of custom_id to response content (download_batch_results)
+        batches: Lists of email bodies the requests were built from
+        verbose: Whether to print progress messages
+
+    Returns:
+        Flat list of specific prompts in the same order as input
+    """
+    prompts = []
+    for i, batch in enumerate(batches):
+        if verbose and f"gen-{i}" not in results:
+            print(f"  Warning: Request gen-{i} failed, using the default prompt for {len(batch)} emails")
+        prompts.extend(parse_enhanced_prompts(results.get(f"gen-{i}"), len(batch)))
     return prompts
 
 
-def enhance_generic_prompts(client: OpenAI, examples: list[dict], verbose: bool = True) -> tuple[list[dict], int]:
+def generate_specific_prompts_batch_api(client: "OpenAI", batches: list[list[str]], verbose: bool = True) -> list[str]:
     """
-    Enhance generic prompts in training examples using batched API calls.
+    Generate specific prompts for all batches through a single Batch API job.
+
+    Each batch of emails becomes one request in the job. Emails whose request
+    failed, or that came back without a prompt, get the default generic
+    prompt so results stay aligned with the input.
 
     Args:
         client: OpenAI client instance
-        examples: List of training examples in OpenAI format
+        batches: Lists of email bodies, one list per request
         verbose: Whether to print progress messages
 
     Returns:
-        Tuple of (enhanced_examples, num_api_calls)
+        Flat list of specific prompts in the same order as input
+    """
+    requests = build_enhancement_requests(batches)
+
+    batch_id = submit_batch(client, requests)
+    if verbose:
+        print(f"  Submitted Batch API job {batch_id} ({len(requests)} requests)")
+        print("  Waiting for results (usually minutes, up to 24 hours)...")
+
+    batch_job = wait_for_batch(client, batch_id, verbose=verbose)
+    if batch_job.status != "completed":
+        raise RuntimeError(f"Batch job {batch_id} ended with status: {batch_job.status}")
+
+    return parse_batch_results(download_batch_results(client, batch_job), batches, verbose=verbose)
+
+
+def find_generic_prompts(examples: list[dict]) -> tuple[list[int], list[str]]:
+    """
+    Find the examples whose user prompt is one of the generic prompts.
+
+    Args:
+        examples: List of training examples in OpenAI format
+
+    Returns:
+        Tuple of (example_indices, assistant_bodies) for the generic examples
     """
-    # Identify generic prompts
     generic_indices = []
     generic_bodies = []
 
@@ -87,58 +216,109 @@ def enhance_generic_prompts(client: OpenAI, examples: list[dict], verbose: bool
         if "messages" not in example:
             continue
 
-        msgs = example["messages"]
-        user_msg = next((m["content"] for m in msgs if m["role"] == "user"), "")
-        assistant_msg = next((m["content"] for m in msgs if m["role"] == "assistant"), "")
+        # Find the first user and assistant messages in a single pass
+        user_msg = assistant_msg = None
+        for m in example["messages"]:
+            role = m["role"]
+            if role == "user" and user_msg is None:
+                user_msg = m["content"]
+            elif role == "assistant" and assistant_msg is None:
+                assistant_msg = m["content"]
 
         # Check if it's a generic prompt
-        if user_msg.lower().strip() in GENERIC_PROMPTS:
+        if user_msg is not None and user_msg.lower().strip() in GENERIC_PROMPTS:
             generic_indices.append(idx)
-            generic_bodies.append(assistant_msg)
+            generic_bodies.append(assistant_msg if assistant_msg is not None else "")
 
-    if verbose:
-        print(f"Found {len(generic_indices)} generic prompts to enhance")
-
-    if not generic_indices:
-        return examples, 0
+    return generic_indices, generic_bodies
 
-    # Process generic prompts in batches
-    refined_prompts = []
-    num_batches = (len(generic_bodies) + PROMPT_ENHANCEMENT_BATCH_SIZE - 1) // PROMPT_ENHANCEMENT_BATCH_SIZE
 
-    for i in range(0, len(generic_bodies), PROMPT_ENHANCEMENT_BATCH_SIZE):
-        batch = generic_bodies[i:i + PROMPT_ENHANCEMENT_BATCH_SIZE]
-        batch_num = i // PROMPT_ENHANCEMENT_BATCH_SIZE + 1
+def batch_email_bodies(bodies: list[str]) -> list[list[str]]:
+    """Split email bodies into groups of PROMPT_ENHANCEMENT_BATCH_SIZE, one group per API request."""
+    return [
+        bodies[i:i + PROMPT_ENHANCEMENT_BATCH_SIZE]
+        for i in range(0, len(bodies), PROMPT_ENHANCEMENT_BATCH_SIZE)
+    ]
 
-        if verbose:
-            print(f"  Processing batch {batch_num}/{num_batches} ({len(batch)} emails)...")
 
-        batch_prompts = generate_specific_prompts_batch(client, batch)
-        refined_prompts.extend(batch_prompts)
+def apply_refined_prompts(examples: list[dict], generic_indices: list[int], generic_bodies: list[str],
+                          refined_prompts: list[str]) -> list[dict]:
+    """
+    Replace generic prompts with refined ones.
 
-    # Verify we got the right number of responses
-    if len(refined_prompts) != len(generic_indices):
-        if verbose:
-            print(f"  Warning: Expected {len(generic_indices)} prompts but got {len(refined_prompts)}")
-        # Pad with generic prompts if needed
-        while len(refined_prompts) < len(generic_indices):
-            refined_prompts.append("Write an email in your tone.")
+    Args:
+        examples: List of training examples in OpenAI format
+        generic_indices: Indices of the generic examples (find_generic_prompts)
+        generic_bodies: Assistant bodies of the generic examples
+        refined_prompts: New prompt for each generic example
 
-    # Replace generic prompts with refined ones
+    Returns:
+        Copy of examples with the generic examples rebuilt around the new prompts
+    """
     enhanced_examples = examples.copy()
-    for idx, refined_prompt in zip(generic_indices, refined_prompts):
-        example = enhanced_examples[idx]
-        msgs = example["messages"]
-        assistant_msg = next((m["content"] for m in msgs if m["role"] == "assistant"), "")
-
+    for idx, assistant_msg, refined_prompt in zip(generic_indices, generic_bodies, refined_prompts):
         enhanced_examples[idx] = {
             "messages": [
                 {"role": "user", "content": refined_prompt},
                 {"role": "assistant", "content": assistant_msg}
             ]
         }
+    return enhanced_examples
+
+
+def enhance_generic_prompts(client: "OpenAI", examples: list[dict], verbose: bool = True,
+                            use_batch_api: bool = False,
+                            max_concurrency: int = PROMPT_ENHANCEMENT_MAX_CONCURRENCY) -> tuple[list[dict], int]:
+    """
+    Enhance generic prompts in training examples using batched API calls.
+
+    Batches are sent concurrently (up to max_concurrency at once) and
+    throttled to stay under the configured requests/tokens per minute.
+
+    Args:
+        client: OpenAI client instance
+        examples: List of training examples in OpenAI format
+        verbose: Whether to print progress messages
+        use_batch_api: Submit all requests as one OpenAI Batch API job
+            (half price, but can take up to 24 hours) and wait for it
+            instead of calling the API directly
+        max_concurrency: Maximum number of API calls in flight at once
+
+    Returns:
+        Tuple of (enhanced_examples, num_api_calls)
+    """
+    generic_indices, generic_bodies = find_generic_prompts(examples)
+
+    if verbose:
+        print(f"Found {len(generic_indices)} generic prompts to enhance")
+
+    if not generic_indices:
+        return examples, 0
+
+    # Process generic prompts in batches
+    batches = batch_email_bodies(generic_bodies)
+    num_batches = len(batches)
+
+    if use_batch_api:
+        refined_prompts = generate_specific_prompts_batch_api(client, batches, verbose=verbose)
+    else:
+        rate_limiter = RateLimiter(PROMPT_ENHANCEMENT_REQUESTS_PER_MINUTE, PROMPT_ENHANCEMENT_TOKENS_PER_MINUTE)
+
+        def process_batch(batch_num, batch):
+            if verbose:
+                print(f"  Processing batch {batch_num}/{num_batches} ({len(batch)} emails)...")
+            return generate_specific_prompts_batch(client, batch, rate_limiter=rate_limiter)
+
+        # executor.map returns results in input order, so prompts stay aligned
+        refined_prompts = []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, num_batches))) as executor:
+            for batch_prompts in executor.map(process_batch, range(1, num_batches + 1), batches):
+                refined_prompts.extend(batch_prompts)
+
+    enhanced_examples = apply_refined_prompts(examples, generic_indices, generic_bodies, refined_prompts)
 
     if verbose:
-        print(f"  Enhanced {len(generic_indices)} prompts using {num_batches} API calls")
+        method = "Batch API requests" if use_batch_api else "API calls"
+        print(f"  Enhanced {len(generic_indices)} prompts using {num_batches} {method}")
 
     return enhanced_examples, num_batches
@@ -6,9 +6,13 @@ Converts a Gmail .mbox export into training and validation datasets
 for OpenAI fine-tuning.
 
 Usage:
-    python prepare_data.py path/to/Sent.mbox your.email@gmail.com
+    python prepare_data.py path/to/Sent.mbox your.email@gmail.com [--batch]
+
+Pass --batch to enhance prompts through the OpenAI Batch API (half price,
+but results can take up to 24 hours).
 """
 
+import os
 import sys
 import json
 import random
@@ -16,6 +20,16 @@ from pathlib import Path
 from openai import OpenAI
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to a character-based estimate
+    tiktoken = None
+
 from lib.email_cleaner import process_mbox
 from lib.prompt_enhancer import enhance_generic_prompts
 from lib.config import (
@@ -24,12 +38,17 @@ from lib.config import (
     VALIDATION_SPLIT_RATIO,
     MIN_TRAINING_EXAMPLES,
     MAX_TRAINING_EXAMPLES,
-    COST_PER_1K_TOKENS
+    FINETUNING_BASE_MODEL,
+    COST_PER_1K_TOKENS,
+    BATCH_API_DISCOUNT
 )
 
 # Load environment variables
 load_dotenv()
 
+# Number of examples serialized per write() call
+JSONL_WRITE_CHUNK_SIZE = 1024
+
 
 def estimate_tokens(text: str) -> int:
     """
@@ -39,27 +58,59 @@ def estimate_tokens(text: str) -> int:
     return len(text) // 4
 
 
-def estimate_cost(examples: list[dict], enhancement_api_calls: int = 0) -> dict:
+def get_tokenizer():
+    """
+    Load the tokenizer used by the fine-tuning base model.
+
+    Returns:
+        tiktoken Encoding, or None if tiktoken isn't installed, doesn't know
+        the model, or can't download the encoding (e.g. offline)
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(FINETUNING_BASE_MODEL)
+    except Exception:
+        return None
+
+
+def count_tokens(texts: list[str]) -> int:
+    """
+    Count the tokens in a list of texts.
+
+    Encodes everything in one multi-threaded tiktoken batch when available,
+    otherwise falls back to estimate_tokens.
+    """
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return sum(estimate_tokens(text) for text in texts)
+
+    # disallowed_special=() treats text like "<|endoftext|>" in emails as plain text
+    encoded = tokenizer.encode_batch(texts, num_threads=os.cpu_count() or 1, disallowed_special=())
+    return sum(len(tokens) for tokens in encoded)
+
+
+def estimate_cost(examples: list[dict], enhancement_api_calls: int = 0, used_batch_api: bool = False) -> dict:
     """
     Estimate the cost of fine-tuning based on the number of tokens.
 
     Args:
         examples: List of training examples
         enhancement_api_calls: Number of API calls made for prompt enhancement
+        used_batch_api: Whether prompt enhancement went through the Batch API
 
     Returns:
         Dictionary with cost breakdown
     """
-    total_tokens = 0
-
-    for example in examples:
-        for msg in example.get("messages", []):
-            total_tokens += estimate_tokens(msg.get("content", ""))
+    contents = [msg.get("content", "") for example in examples for msg in example.get("messages", [])]
+    total_tokens = count_tokens(contents)
 
     training_cost = (total_tokens / 1000) * COST_PER_1K_TOKENS["training"]
 
     # Estimate prompt enhancement cost (rough approximation)
     enhancement_cost = enhancement_api_calls * 0.02  # Rough per-batch cost
+    if used_batch_api:
+        enhancement_cost *= BATCH_API_DISCOUNT
 
     return {
         "total_tokens": total_tokens,
@@ -81,26 +132,34 @@ def split_dataset(examples: list[dict], val_ratio: float = VALIDATION_SPLIT_RATI
     Returns:
         Tuple of (training_examples, validation_examples)
     """
-    # Shuffle with seed for reproducibility
-    random.seed(seed)
-    shuffled = examples.copy()
-    random.shuffle(shuffled)
+    # Shuffle indices with a seeded generator for reproducibility, so the
+    # examples are only gathered once into their final lists
+    rng = random.Random(seed)
+    indices = list(range(len(examples)))
+    rng.shuffle(indices)
 
     # Calculate split point
-    total = len(shuffled)
-    val_count = int(total * val_ratio)
+    val_count = int(len(examples) * val_ratio)
 
-    val_examples = shuffled[:val_count]
-    train_examples = shuffled[val_count:]
+    val_examples = [examples[i] for i in indices[:val_count]]
+    train_examples = [examples[i] for i in indices[val_count:]]
 
     return train_examples, val_examples
 
 
+def dumps_jsonl_line(example: dict) -> bytes:
+    """Serialize one example as a UTF-8 JSONL line (uses orjson when installed)."""
+    if orjson:
+        return orjson.dumps(example) + b"\n"
+    return (json.dumps(example, ensure_ascii=False) + "\n").encode("utf-8")
+
+
 def write_jsonl(examples: list[dict], filepath: str):
-    """Write examples to JSONL file."""
-    with open(filepath, 'w', encoding='utf-8') as f:
-        for example in examples:
-            f.write(json.dumps(example, ensure_ascii=False) + '\n')
+    """Write examples to JSONL file, one write() call per chunk of examples."""
+    with open(filepath, 'wb') as f:
+        for i in range(0, len(examples), JSONL_WRITE_CHUNK_SIZE):
+            chunk = examples[i:i + JSONL_WRITE_CHUNK_SIZE]
+            f.write(b"".join(dumps_jsonl_line(example) for example in chunk))
 
 
 def main():
@@ -111,15 +170,19 @@ def main():
 
     # Check arguments
     if len(sys.argv) < 3:
-        print("Usage: python prepare_data.py <mbox_file> <your_email>")
+        print("Usage: python prepare_data.py <mbox_file> <your_email> [--batch]")
         print()
         print("Example:")
         print("  python prepare_data.py ~/Downloads/Sent.mbox you@gmail.com")
         print()
+        print("Options:")
+        print("  --batch  Enhance prompts via the OpenAI Batch API (50% cheaper, up to 24h)")
+        print()
         sys.exit(1)
 
     mbox_path = sys.argv[1]
     user_email = sys.argv[2]
+    use_batch_api = "--batch" in sys.argv[3:]
 
     # Validate inputs
     if not Path(mbox_path).exists():
@@ -158,8 +221,9 @@ def main():
     # Step 2: Enhance generic prompts
     print("Step 2/4: Enhancing generic prompts...")
     try:
-        client = OpenAI()
-        enhanced_dataset, api_calls = enhance_generic_prompts(client, dataset, verbose=True)
+        # retry_openai is the retry policy, so turn off the SDK's own retries
+        client = OpenAI(max_retries=0)
+        enhanced_dataset, api_calls = enhance_generic_prompts(client, dataset, verbose=True, use_batch_api=use_batch_api)
     except Exception as e:
         print(f"  ⚠️  Warning: Prompt enhancement failed: {e}")
         print("  Continuing with original prompts...")
@@ -189,7 +253,7 @@ def main():
     print("=" * 60)
     print("Cost Estimate")
     print("=" * 60)
-    costs = estimate_cost(train_examples, api_calls)
+    costs = estimate_cost(train_examples, api_calls, used_batch_api=use_batch_api)
 
     print(f"Total tokens: ~{costs['total_tokens']:,}")
     print(f"Prompt enhancement: ${costs['enhancement_cost_usd']:.3f}")
@@ -8,32 +8,54 @@ Usage:
     python test_model.py
 """
 
+import functools
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from openai import OpenAI
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
 from lib.config import MODEL_INFO_FILE, FINETUNING_BASE_MODEL
+from lib.api_utils import retry_openai
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 # Load environment variables
 load_dotenv()
 
+# Maximum number of generation requests in flight at once
+MAX_CONCURRENT_GENERATIONS = 10
+
 
 def load_model_info() -> dict:
-    """Load the fine-tuned model info from file."""
-    if not Path(MODEL_INFO_FILE).exists():
+    """Load the fine-tuned model info from file (re-read only when the file changes)."""
+    path = Path(MODEL_INFO_FILE)
+    if not path.exists():
         raise FileNotFoundError(
             f"Model info file not found: {MODEL_INFO_FILE}\n"
             "Please run finetune.py first to create a fine-tuned model."
         )
 
-    with open(MODEL_INFO_FILE, 'r') as f:
-        return json.load(f)
+    return _load_model_info(str(path), path.stat().st_mtime_ns)
 
 
-def generate_email(client: OpenAI, model_id: str, prompt: str, max_tokens: int = 500) -> str:
+@functools.lru_cache(maxsize=8)
+def _load_model_info(path: str, mtime_ns: int) -> dict:
+    """Parse a model info file, cached per path and modification time."""
+    data = Path(path).read_bytes()
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+@retry_openai()
+def generate_email(client: "OpenAI", model_id: str, prompt: str, max_tokens: int = 500) -> str:
     """
-    Generate an email using the fine-tuned model.
+    Generate an email using the fine-tuned model, retrying on transient API errors.
 
     Args:
         client: OpenAI client instance
@@ -56,7 +78,33 @@ def generate_email(client: OpenAI, model_id: str, prompt: str, max_tokens: int =
     return response.choices[0].message.content
 
 
-def compare_with_base(client: OpenAI, fine_tuned_model: str, base_model: str, prompt: str):
+def generate_emails(client: "OpenAI", model_id: str, prompts: list[str], max_tokens: int = 500,
+                    max_concurrency: int = MAX_CONCURRENT_GENERATIONS) -> list:
+    """
+    Generate emails for several prompts concurrently.
+
+    Args:
+        client: OpenAI client instance
+        model_id: Fine-tuned model ID
+        prompts: User prompts
+        max_tokens: Maximum tokens in each response
+        max_concurrency: Maximum number of requests in flight at once
+
+    Returns:
+        List with the generated email text, or the exception raised, for
+        each prompt in input order
+    """
+    def generate(prompt):
+        try:
+            return generate_email(client, model_id, prompt, max_tokens=max_tokens)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(prompts)))) as executor:
+        return list(executor.map(generate, prompts))
+
+
+def compare_with_base(client: "OpenAI", fine_tuned_model: str, base_model: str, prompt: str):
     """
     Compare fine-tuned model output with base model.
 
@@ -87,7 +135,7 @@ def compare_with_base(client: OpenAI, fine_tuned_model: str, base_model: str, pr
     print()
 
 
-def interactive_mode(client: OpenAI, model_id: str, base_model: str):
+def interactive_mode(client: "OpenAI", model_id: str, base_model: str):
     """
     Run interactive testing mode.
 
@@ -102,8 +150,9 @@ def interactive_mode(client: OpenAI, model_id: str, base_model: str):
     print()
     print("Enter prompts to test your fine-tuned model.")
     print("Commands:")
-    print("  /compare - Compare with base model for the last prompt")
-    print("  /quit    - Exit")
+    print("  /compare     - Compare with base model for the last prompt")
+    print("  /batch FILE  - Generate emails for every prompt in FILE (one per line)")
+    print("  /quit        - Exit")
     print()
 
     last_prompt = None
@@ -126,6 +175,31 @@ def interactive_mode(client: OpenAI, model_id: str, base_model: str):
                     print("No previous prompt to compare. Please enter a prompt first.")
                 continue
 
+            # Exact command match, so prompts like "/batching ..." are still generated
+            if prompt == "/batch" or prompt.startswith("/batch "):
+                parts = prompt.split(maxsplit=1)
+                if len(parts) < 2:
+                    print("Usage: /batch path/to/prompts.txt")
+                    continue
+
+                batch_prompts = [line.strip() for line in Path(parts[1]).read_text(encoding="utf-8").splitlines()
+                                 if line.strip()]
+                print(f"\nGenerating {len(batch_prompts)} emails...")
+                responses = generate_emails(client, model_id, batch_prompts)
+
+                for i, (batch_prompt, response) in enumerate(zip(batch_prompts, responses), 1):
+                    print(f"\n[{i}] {batch_prompt}")
+                    print("-" * 60)
+                    if isinstance(response, Exception):
+                        print(f"Error: {response}")
+                    else:
+                        print(response)
+                print()
+
+                if batch_prompts:
+                    last_prompt = batch_prompts[-1]
+                continue
+
             # Generate email
             print("\nGenerating email...")
             print("-" * 60)
@@ -164,7 +238,9 @@ def main():
 
     # Initialize OpenAI client
     try:
-        client = OpenAI()
+        from openai import OpenAI
+        # retry_openai is the retry policy, so turn off the SDK's own retries
+        client = OpenAI(max_retries=0)
     except Exception as e:
         print(f"Error initializing OpenAI client: {e}")
         print()
@@ -183,14 +259,16 @@ def main():
         "Write a short message declining a meeting invitation politely.",
     ]
 
-    for i, prompt in enumerate(test_prompts, 1):
+    # Send all examples at once, then print them in order
+    responses = generate_emails(client, model_id, test_prompts, max_tokens=300)
+
+    for i, (prompt, response) in enumerate(zip(test_prompts, responses), 1):
         print(f"Example {i}: {prompt}")
         print("-" * 60)
-        try:
-            response = generate_email(client, model_id, prompt, max_tokens=300)
+        if isinstance(response, Exception):
+            print(f"Error: {response}")
+        else:
             print(response)
-        except Exception as e:
-            print(f"Error: {e}")
         print()
 
     # Enter interactive mode
@@ -5,6 +5,7 @@ Handles creating and monitoring fine-tuning jobs.
 """
 
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import streamlit as st
 
@@ -18,7 +19,31 @@ from lib.config import (
     FINE_TUNING_HYPERPARAMETERS
 )
 
-from .shared import upload_file_to_openai, create_fine_tuning_job, get_openai_client
+from .shared import (
+    upload_file_to_openai,
+    create_fine_tuning_job,
+    get_openai_client,
+    count_lines,
+    path_exists,
+    invalidate_path_cache,
+    estimate_cost_from_jsonl
+)
+
+# Seconds between automatic status refreshes while a job is running
+MONITOR_REFRESH_SECONDS = 15
+TERMINAL_STATUSES = {"succeeded", "failed", "cancelled"}
+
+# Short base model name shown in the metrics row (e.g., "gpt-4o-mini")
+_BASE_MODEL_SHORT = "-".join(FINETUNING_BASE_MODEL.split("-")[:3])
+
+_STATUS_COLORS = {
+    "validating_files": "🔵",
+    "queued": "🟡",
+    "running": "🟠",
+    "succeeded": "🟢",
+    "failed": "🔴",
+    "cancelled": "⚫"
+}
 
 
 def render():
@@ -27,24 +52,43 @@ def render():
     st.markdown("Create a personalized email writing model using your data.")
 
     # Check if training data exists
-    if not Path(TRAINING_FILE).exists():
+    if not path_exists(TRAINING_FILE):
+        st.warning("No training data found. Please prepare data first in the 'Prepare Data' tab.")
+        st.stop()
+
+    # Count examples. path_exists is cached, so the files may have been removed
+    # since (e.g., by another session or the CLI).
+    try:
+        train_count = count_lines(TRAINING_FILE)
+        training_cost = estimate_cost_from_jsonl(TRAINING_FILE)["training_cost_usd"]
+    except FileNotFoundError:
+        invalidate_path_cache(TRAINING_FILE)
         st.warning("No training data found. Please prepare data first in the 'Prepare Data' tab.")
         st.stop()
 
+    try:
+        val_count = count_lines(VALIDATION_FILE) if path_exists(VALIDATION_FILE) else 0
+    except FileNotFoundError:
+        invalidate_path_cache(VALIDATION_FILE)
+        val_count = 0
+
     # Display dataset info
     st.success("Training data ready!")
 
-    # Count examples
-    train_count = sum(1 for _ in open(TRAINING_FILE))
-    val_count = sum(1 for _ in open(VALIDATION_FILE)) if Path(VALIDATION_FILE).exists() else 0
-
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns(4)
     with col1:
         st.metric("Training Examples", train_count)
     with col2:
         st.metric("Validation Examples", val_count)
     with col3:
-        st.metric("Default Model", "-".join(FINETUNING_BASE_MODEL.split("-")[:3]))
+        st.metric("Default Model", _BASE_MODEL_SHORT)
+    with col4:
+        st.metric(
+            "Est. Cost per Epoch",
+            f"${training_cost:.2f}",
+            help="Estimated from the training file at ~4 characters per token. "
+                 "The total cost is this times the number of epochs."
+        )
 
     st.markdown("---")
 
@@ -138,10 +182,15 @@ def render():
                 client = get_openai_client()
 
                 with st.spinner("Uploading files to OpenAI..."):
-                    training_file_id = upload_file_to_openai(client, TRAINING_FILE, "fine-tune")
-                    validation_file_id = None
-                    if Path(VALIDATION_FILE).exists():
-                        validation_file_id = upload_file_to_openai(client, VALIDATION_FILE, "fine-tune")
+                    # Upload training and validation files in parallel over the shared client
+                    with ThreadPoolExecutor(max_workers=2) as executor:
+                        training_upload = executor.submit(upload_file_to_openai, client, TRAINING_FILE, "fine-tune")
+                        validation_upload = None
+                        if Path(VALIDATION_FILE).exists():
+                            validation_upload = executor.submit(upload_file_to_openai, client, VALIDATION_FILE, "fine-tune")
+
+                        training_file_id = training_upload.result()
+                        validation_file_id = validation_upload.result() if validation_upload else None
                     st.success("✓ Files uploaded")
 
                 with st.spinner("Creating fine-tuning job..."):
@@ -169,91 +218,98 @@ def render():
     if st.session_state.finetuning_job_id:
         st.info(f"Job ID: {st.session_state.finetuning_job_id}")
 
-        # Manual refresh button
-        col1, col2 = st.columns([1, 4])
-        with col1:
-            if st.button("Refresh Status"):
-                st.rerun()
-
-        try:
-            client = get_openai_client()
-            job = client.fine_tuning.jobs.retrieve(st.session_state.finetuning_job_id)
-            status = job.status
-
-            # Display status
-            status_colors = {
-                "validating_files": "🔵",
-                "queued": "🟡",
-                "running": "🟠",
-                "succeeded": "🟢",
-                "failed": "🔴",
-                "cancelled": "⚫"
+        # Only keep polling while the job can still change
+        finished = st.session_state.finetuning_status in TERMINAL_STATUSES
+        monitor = st.fragment(_monitor_job, run_every=None if finished else MONITOR_REFRESH_SECONDS)
+        monitor(st.session_state.finetuning_job_id)
+
+
+def _monitor_job(job_id: str):
+    """
+    Show the status of a fine-tuning job.
+
+    Runs as a fragment, so periodic refreshes only re-run this function
+    rather than the whole app.
+
+    Args:
+        job_id: Fine-tuning job ID
+    """
+    try:
+        client = get_openai_client()
+        job = client.fine_tuning.jobs.retrieve(job_id)
+        status = job.status
+
+        # Rerun the whole app once the job finishes so polling stops
+        was_running = st.session_state.finetuning_status not in TERMINAL_STATUSES
+        st.session_state.finetuning_status = status
+        if status in TERMINAL_STATUSES and was_running:
+            st.rerun()
+
+        # Display status
+        st.markdown(f"### {_STATUS_COLORS.get(status, '⚪')} Status: {status}")
+
+        if job.trained_tokens:
+            st.metric("Trained Tokens", f"{job.trained_tokens:,}")
+
+        # Handle completion
+        if status == "succeeded":
+            st.success("✅ Fine-tuning completed successfully!")
+            st.code(job.fine_tuned_model, language=None)
+
+            # Save model info
+            model_info = {
+                "job_id": job_id,
+                "model_id": job.fine_tuned_model,
+                "base_model": FINETUNING_BASE_MODEL,
+                "trained_tokens": job.trained_tokens,
+                "status": status
             }
 
-            st.markdown(f"### {status_colors.get(status, '⚪')} Status: {status}")
-
-            if job.trained_tokens:
-                st.metric("Trained Tokens", f"{job.trained_tokens:,}")
+            with open(MODEL_INFO_FILE, 'w') as f:
+                json.dump(model_info, f, indent=2)
 
-            # Handle completion
-            if status == "succeeded":
-                st.success("✅ Fine-tuning completed successfully!")
-                st.code(job.fine_tuned_model, language=None)
+            st.success(f"Model info saved to {MODEL_INFO_FILE}")
+            st.info("Go to the 'Test Model' tab to try your fine-tuned model!")
 
-                # Save model info
-                model_info = {
-                    "job_id": st.session_state.finetuning_job_id,
-                    "model_id": job.fine_tuned_model,
-                    "base_model": FINETUNING_BASE_MODEL,
-                    "trained_tokens": job.trained_tokens,
-                    "status": status
-                }
+            # Clean up job tracking file
+            if Path(CURRENT_JOB_FILE).exists():
+                Path(CURRENT_JOB_FILE).unlink()
 
-                with open(MODEL_INFO_FILE, 'w') as f:
-                    json.dump(model_info, f, indent=2)
-
-                st.success(f"Model info saved to {MODEL_INFO_FILE}")
-                st.info("Go to the 'Test Model' tab to try your fine-tuned model!")
-
-                # Clean up job tracking file
-                if Path(CURRENT_JOB_FILE).exists():
-                    Path(CURRENT_JOB_FILE).unlink()
-
-                # Reset session state
-                if st.button("Reset (start new fine-tuning)"):
-                    st.session_state.finetuning_job_id = None
-                    st.session_state.finetuning_status = None
-                    st.rerun()
+            # Reset session state
+            if st.button("Reset (start new fine-tuning)"):
+                st.session_state.finetuning_job_id = None
+                st.session_state.finetuning_status = None
+                st.rerun()
 
-            elif status == "failed":
-                st.error("❌ Fine-tuning failed!")
-                if job.error:
-                    st.error(f"Error: {job.error}")
+        elif status == "failed":
+            st.error("❌ Fine-tuning failed!")
+            if job.error:
+                st.error(f"Error: {job.error}")
 
-                # Clean up job tracking file
-                if Path(CURRENT_JOB_FILE).exists():
-                    Path(CURRENT_JOB_FILE).unlink()
+            # Clean up job tracking file
+            if Path(CURRENT_JOB_FILE).exists():
+                Path(CURRENT_JOB_FILE).unlink()
 
-                if st.button("Reset"):
-                    st.session_state.finetuning_job_id = None
-                    st.session_state.finetuning_status = None
-                    st.rerun()
+            if st.button("Reset"):
+                st.session_state.finetuning_job_id = None
+                st.session_state.finetuning_status = None
+                st.rerun()
 
-            elif status == "cancelled":
-                st.warning("⚠️ Fine-tuning was cancelled")
+        elif status == "cancelled":
+            st.warning("⚠️ Fine-tuning was cancelled")
 
-                # Clean up job tracking file
-                if Path(CURRENT_JOB_FILE).exists():
-                    Path(CURRENT_JOB_FILE).unlink()
+            # Clean up job tracking file
+            if Path(CURRENT_JOB_FILE).exists():
+                Path(CURRENT_JOB_FILE).unlink()
 
-                if st.button("Reset"):
-                    st.session_state.finetuning_job_id = None
-                    st.session_state.finetuning_status = None
-                    st.rerun()
+            if st.button("Reset"):
+                st.session_state.finetuning_job_id = None
+                st.session_state.finetuning_status = None
+                st.rerun()
 
-            else:
-                st.info("Fine-tuning in progress. This may take 20-60 minutes. Refresh this page to check status.")
-                st.info("💡 You can close this page and come back later - the job will continue running.")
+        else:
+            st.info(f"Fine-tuning in progress. This may take 20-60 minutes. Status refreshes every {MONITOR_REFRESH_SECONDS} seconds.")
+            st.info("💡 You can close this page and come back later - the job will continue running.")
 
-        except Exception as e:
-            st.error(f"Error monitoring job: {e}")
+    except Exception as e:
+        st.error(f"Error monitoring job: {e}")
@@ -4,14 +4,52 @@ Tab 1: Prepare Training Data
 Handles uploading .mbox files and creating training datasets.
 """
 
+import hashlib
+import shutil
+import tempfile
 from pathlib import Path
 import streamlit as st
 
 from lib.email_cleaner import process_mbox
-from lib.prompt_enhancer import enhance_generic_prompts
+from lib.prompt_enhancer import (
+    enhance_generic_prompts,
+    find_generic_prompts,
+    batch_email_bodies,
+    build_enhancement_requests,
+    parse_batch_results,
+    apply_refined_prompts
+)
+from lib.batch_api import BATCH_TERMINAL_STATUSES, submit_batch, retrieve_batch, download_batch_results
 from lib.config import TRAINING_FILE, VALIDATION_FILE, MIN_TRAINING_EXAMPLES, MAX_TRAINING_EXAMPLES
 
-from .shared import estimate_cost, split_dataset, write_jsonl, get_openai_client
+from .shared import estimate_cost, split_and_write_jsonl, get_openai_client, invalidate_path_cache
+
+# Seconds between automatic status refreshes while a prompt enhancement batch is running
+ENHANCEMENT_BATCH_REFRESH_SECONDS = 30
+
+
+# Only the most recent uploads are kept, since each entry holds cleaned personal email bodies
+@st.cache_data(persist="disk", max_entries=2, show_spinner=False)
+def _cached_process_mbox(_uploaded_file, user_email: str, content_hash: str) -> list[dict]:
+    """
+    Extract examples from an uploaded mbox file, cached on disk by file content and email.
+
+    Re-uploading the same export skips both the copy to disk and parsing,
+    even after a server restart. The upload itself is excluded from the
+    cache key (leading underscore); content_hash identifies it instead.
+    """
+    # Save uploaded file temporarily, copying it in 1 MB chunks.
+    # A unique temp file keeps concurrent sessions from clobbering each other.
+    with tempfile.NamedTemporaryFile(suffix=".mbox", delete=False) as f:
+        temp_path = Path(f.name)
+    try:
+        with open(temp_path, "wb") as f:
+            _uploaded_file.seek(0)
+            shutil.copyfileobj(_uploaded_file, f, length=1024 * 1024)
+        return process_mbox(str(temp_path), user_email)
+    finally:
+        # Also runs when a rerun interrupts processing (a BaseException)
+        temp_path.unlink(missing_ok=True)
 
 
 def render():
@@ -34,6 +72,13 @@ def render():
             help="This helps identify which emails are yours in the .mbox file"
         )
 
+        use_batch_api = st.checkbox(
+            "Enhance prompts via Batch API (50% cheaper, can take up to 24 hours)",
+            value=False,
+            help="Sends all prompt enhancement requests as one OpenAI Batch API job. "
+                 "Batches usually finish within minutes; keep this page open until the training files are written."
+        )
+
     with col2:
         st.info("""
         **How to get your .mbox file:**
@@ -44,74 +89,216 @@ def render():
         4. Upload the Sent.mbox file here
         """)
 
-    if st.button("Process Data", type="primary", disabled=not (uploaded_file and user_email)):
-        with st.spinner("Processing emails..."):
-            try:
-                # Save uploaded file temporarily
-                temp_path = Path("temp_uploaded.mbox")
-                with open(temp_path, "wb") as f:
-                    f.write(uploaded_file.getvalue())
-
-                # Step 1: Extract and clean emails
-                st.info("Step 1/4: Extracting and cleaning emails...")
-                dataset = process_mbox(str(temp_path), user_email)
-                st.success(f"✓ Found {len(dataset)} clean email examples")
-
-                # Check minimum requirements
-                if len(dataset) < MIN_TRAINING_EXAMPLES:
-                    st.error(f"Only {len(dataset)} examples found. OpenAI requires at least {MIN_TRAINING_EXAMPLES} examples.")
-                    temp_path.unlink()
-                    st.stop()
-
-                # Cap dataset size to limit excessive training time 
-                if len(dataset) > MAX_TRAINING_EXAMPLES:
-                    st.warning(f"⚠️ Dataset contains {len(dataset)} examples. Limiting to {MAX_TRAINING_EXAMPLES} to limit training time.")
-                    dataset = dataset[:MAX_TRAINING_EXAMPLES]
-                    st.info(f"Using {len(dataset)} examples for training (this is plenty for high-quality results)")
-
-                # Step 2: Enhance generic prompts
-                st.info("Step 2/4: Enhancing generic prompts...")
+    # Only one prompt enhancement batch runs per session
+    batch_pending = "enhancement_batch" in st.session_state
+
+    if st.button("Process Data", type="primary", disabled=not (uploaded_file and user_email) or batch_pending):
+        # Identical exports hit the on-disk cache of extracted examples.
+        # file_digest hashes the upload in place instead of copying it with getvalue().
+        uploaded_file.seek(0)
+        content_hash = hashlib.file_digest(uploaded_file, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+        # Don't re-run the pipeline (and pay for prompt enhancement again) when
+        # the same file and email were already processed in this session
+        processed_key = f"{content_hash}:{user_email}"
+        if st.session_state.get("last_processed_key") == processed_key and Path(TRAINING_FILE).exists():
+            st.info(f"This file was already processed. {TRAINING_FILE} and {VALIDATION_FILE} are ready - "
+                    "go to the 'Fine-Tune Model' tab to continue.")
+        else:
+            with st.spinner("Processing emails..."):
                 try:
-                    client = get_openai_client()
-                    enhanced_dataset, api_calls = enhance_generic_prompts(client, dataset, verbose=False)
-                    st.success(f"✓ Enhanced prompts using {api_calls} API calls")
+                    # Step 1: Extract and clean emails
+                    st.info("Step 1/3: Extracting and cleaning emails...")
+                    dataset = _cached_process_mbox(uploaded_file, user_email, content_hash)
+                    st.success(f"✓ Found {len(dataset)} clean email examples")
+
+                    # Check minimum requirements
+                    if len(dataset) < MIN_TRAINING_EXAMPLES:
+                        st.error(f"Only {len(dataset)} examples found. OpenAI requires at least {MIN_TRAINING_EXAMPLES} examples.")
+                        st.stop()
+
+                    # Cap dataset size to limit excessive training time 
+                    if len(dataset) > MAX_TRAINING_EXAMPLES:
+                        st.warning(f"⚠️ Dataset contains {len(dataset)} examples. Limiting to {MAX_TRAINING_EXAMPLES} to limit training time.")
+                        dataset = dataset[:MAX_TRAINING_EXAMPLES]
+                        st.info(f"Using {len(dataset)} examples for training (this is plenty for high-quality results)")
+
+                    # Step 2: Enhance generic prompts
+                    st.info("Step 2/3: Enhancing generic prompts...")
+                    enhancement = _enhance_prompts(dataset, use_batch_api, processed_key)
+
+                    # Step 3 runs later, from the batch monitor, when a Batch API job was submitted
+                    if enhancement:
+                        enhanced_dataset, api_calls = enhancement
+                        _write_training_files(enhanced_dataset, api_calls, used_batch_api=use_batch_api)
+                        st.session_state.last_processed_key = processed_key
+
                 except Exception as e:
-                    st.warning(f"Prompt enhancement failed: {e}. Continuing with original prompts...")
-                    enhanced_dataset = dataset
-                    api_calls = 0
-
-                # Step 3: Split dataset
-                st.info("Step 3/4: Splitting into training and validation sets...")
-                train_examples, val_examples = split_dataset(enhanced_dataset)
-                st.success(f"✓ Training: {len(train_examples)} examples, Validation: {len(val_examples)} examples")
-
-                # Step 4: Write files
-                st.info("Step 4/4: Writing output files...")
-                write_jsonl(train_examples, TRAINING_FILE)
-                write_jsonl(val_examples, VALIDATION_FILE)
-                st.success(f"✓ Created {TRAINING_FILE} and {VALIDATION_FILE}")
-
-                # Cost estimation
-                costs = estimate_cost(train_examples, api_calls)
-
-                st.markdown("---")
-                st.subheader("Cost Estimate")
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("Total Tokens", f"{costs['total_tokens']:,}")
-                with col2:
-                    st.metric("Enhancement", f"${costs['enhancement_cost_usd']:.3f}")
-                with col3:
-                    st.metric("Fine-tuning", f"${costs['training_cost_usd']:.3f}")
-                with col4:
-                    st.metric("Total Cost", f"${costs['total_cost_usd']:.2f}")
-
-                st.success("✅ Data preparation complete! Go to the 'Fine-Tune Model' tab to continue.")
-
-                # Clean up temp file
-                temp_path.unlink()
+                    st.error(f"Error processing data: {e}")
+
+    # Finish a batch-enhanced dataset once its Batch API job has ended
+    batch_result = st.session_state.get("enhancement_batch_result")
+    if batch_result:
+        if batch_result["status"] == "completed":
+            st.success(f"✓ Enhanced prompts using {batch_result['api_calls']} Batch API requests")
+        else:
+            st.warning(f"Batch API job ended with status: {batch_result['status']}. Continuing with original prompts...")
+        try:
+            _write_training_files(batch_result["dataset"], batch_result["api_calls"], used_batch_api=True)
+            st.session_state.last_processed_key = batch_result["processed_key"]
+        except Exception as e:
+            st.error(f"Error processing data: {e}")
+        # Cleared only after writing, so an interrupted run writes the files again
+        del st.session_state.enhancement_batch_result
+
+    enhancement_batch = st.session_state.get("enhancement_batch")
+    if enhancement_batch:
+        st.fragment(_monitor_enhancement_batch, run_every=ENHANCEMENT_BATCH_REFRESH_SECONDS)(enhancement_batch)
+
+
+def _enhance_prompts(dataset: list[dict], use_batch_api: bool, processed_key: str):
+    """
+    Enhance generic prompts, or submit them as a Batch API job.
+
+    Args:
+        dataset: Extracted training examples
+        use_batch_api: Submit a Batch API job instead of calling the API directly
+        processed_key: Key of the upload being processed (see render)
+
+    Returns:
+        Tuple of (enhanced_dataset, api_calls), or None if a Batch API job was
+        submitted; the job is then tracked in st.session_state.enhancement_batch
+    """
+    try:
+        client = get_openai_client()
+        if not use_batch_api:
+            enhanced_dataset, api_calls = enhance_generic_prompts(client, dataset, verbose=False)
+            st.success(f"✓ Enhanced prompts using {api_calls} API calls")
+            return enhanced_dataset, api_calls
+
+        generic_indices, generic_bodies = find_generic_prompts(dataset)
+        if not generic_indices:
+            st.success("✓ No generic prompts to enhance")
+            return dataset, 0
+
+        batches = batch_email_bodies(generic_bodies)
+        batch_id = submit_batch(client, build_enhancement_requests(batches))
+    except Exception as e:
+        st.warning(f"Prompt enhancement failed: {e}. Continuing with original prompts...")
+        return dataset, 0
 
+    # Keep everything needed to finish processing, so reruns can't lose the paid batch
+    st.session_state.enhancement_batch = {
+        "batch_id": batch_id,
+        "dataset": dataset,
+        "generic_indices": generic_indices,
+        "generic_bodies": generic_bodies,
+        "processed_key": processed_key,
+    }
+    st.success(f"✓ Submitted Batch API job {batch_id} ({len(batches)} requests)")
+    return None
+
+
+def _monitor_enhancement_batch(enhancement_batch: dict):
+    """
+    Show the status of a prompt enhancement batch and collect its results.
+
+    Runs as a fragment, so periodic refreshes only re-run this function
+    rather than the whole app. Once the job ends, the enhanced dataset is
+    handed to render() through st.session_state.enhancement_batch_result.
+
+    Args:
+        enhancement_batch: Session state entry created by _enhance_prompts
+    """
+    try:
+        client = get_openai_client()
+        batch = retrieve_batch(client, enhancement_batch["batch_id"])
+    except Exception as e:
+        st.warning(f"Couldn't check Batch API job: {e}. Retrying in {ENHANCEMENT_BATCH_REFRESH_SECONDS} seconds.")
+        return
+
+    if batch.status not in BATCH_TERMINAL_STATUSES:
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} requests)" if counts else ""
+        st.info(f"Step 2/3: Batch API job {batch.id} is {batch.status}{progress}. "
+                f"Status refreshes every {ENHANCEMENT_BATCH_REFRESH_SECONDS} seconds; "
+                "the training files are written once the job completes.")
+
+        if st.button("Cancel Batch Job"):
+            try:
+                client.batches.cancel(batch.id)
             except Exception as e:
-                st.error(f"Error processing data: {e}")
-                if temp_path.exists():
-                    temp_path.unlink()
+                st.error(f"Error cancelling batch: {e}")
+                return
+            del st.session_state.enhancement_batch
+            st.rerun()
+        return
+
+    dataset = enhancement_batch["dataset"]
+    if batch.status == "completed":
+        try:
+            results = download_batch_results(client, batch)
+        except Exception as e:
+            st.warning(f"Couldn't download Batch API results: {e}. Retrying in {ENHANCEMENT_BATCH_REFRESH_SECONDS} seconds.")
+            return
+
+        batches = batch_email_bodies(enhancement_batch["generic_bodies"])
+        refined_prompts = parse_batch_results(results, batches, verbose=False)
+        dataset = apply_refined_prompts(
+            dataset, enhancement_batch["generic_indices"], enhancement_batch["generic_bodies"], refined_prompts
+        )
+        api_calls = len(batches)
+    else:
+        api_calls = 0
+
+    st.session_state.enhancement_batch_result = {
+        "dataset": dataset,
+        "api_calls": api_calls,
+        "status": batch.status,
+        "processed_key": enhancement_batch["processed_key"],
+    }
+    del st.session_state.enhancement_batch
+
+    # Rerun the whole app so the files are written and polling stops
+    st.rerun()
+
+
+def _write_training_files(enhanced_dataset: list[dict], api_calls: int, used_batch_api: bool):
+    """
+    Split the dataset, write the training and validation files, and show the cost estimate.
+
+    Args:
+        enhanced_dataset: Training examples with enhanced prompts
+        api_calls: Number of API calls made for prompt enhancement
+        used_batch_api: Whether prompt enhancement went through the Batch API
+    """
+    # Step 3: Split dataset and write files
+    st.info("Step 3/3: Writing training and validation sets...")
+    train_indices, val_indices, write_futures = split_and_write_jsonl(
+        enhanced_dataset, TRAINING_FILE, VALIDATION_FILE
+    )
+    st.success(f"✓ Training: {len(train_indices)} examples, Validation: {len(val_indices)} examples")
+
+    # Cost estimation runs while the files are being written
+    costs = estimate_cost(
+        (enhanced_dataset[i] for i in train_indices), api_calls, used_batch_api=used_batch_api
+    )
+
+    for future in write_futures:
+        future.result()
+    invalidate_path_cache(TRAINING_FILE, VALIDATION_FILE)
+    st.success(f"✓ Created {TRAINING_FILE} and {VALIDATION_FILE}")
+
+    st.markdown("---")
+    st.subheader("Cost Estimate")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Total Tokens", f"{costs['total_tokens']:,}")
+    with col2:
+        st.metric("Enhancement", f"${costs['enhancement_cost_usd']:.3f}")
+    with col3:
+        st.metric("Fine-tuning", f"${costs['training_cost_usd']:.3f}")
+    with col4:
+        st.metric("Total Cost", f"${costs['total_cost_usd']:.2f}")
+
+    st.success("✅ Data preparation complete! Go to the 'Fine-Tune Model' tab to continue.")
@@ -2,50 +2,65 @@
 Shared utilities and helper functions for the Streamlit UI.
 """
 
+import importlib.util
 import json
+import mmap
 import os
 import random
+import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, Iterator, Sized
 import streamlit as st
-from openai import OpenAI
 
-from lib.config import VALIDATION_SPLIT_RATIO, COST_PER_1K_TOKENS
-
-
-def get_api_key() -> str:
-    """
-    Get OpenAI API key from session state or environment.
-
-    Returns:
-        API key string or None if not found
-    """
-    # Check session state first
-    if 'openai_api_key' in st.session_state and st.session_state.openai_api_key:
-        return st.session_state.openai_api_key
-
-    # Fall back to environment variable
-    return os.getenv('OPENAI_API_KEY')
-
-
-def get_openai_client() -> OpenAI:
-    """
-    Create an OpenAI client using the API key from session state or environment.
-
-    Returns:
-        OpenAI client instance
-
-    Raises:
-        ValueError if no API key is found
-    """
-    api_key = get_api_key()
-    if not api_key:
-        raise ValueError("No OpenAI API key found. Please enter your API key.")
-
-    return OpenAI(api_key=api_key)
-
-
-def apply_custom_css():
-    """Apply custom CSS styling to the Streamlit app."""
-    st.markdown("""
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+from lib.config import (
+    VALIDATION_SPLIT_RATIO,
+    COST_PER_1K_TOKENS,
+    BATCH_API_DISCOUNT,
+    GENERATION_REQUESTS_PER_MINUTE,
+    GENERATION_TOKENS_PER_MINUTE,
+    GENERATION_MAX_CONCURRENCY,
+    GENERATION_MAX_TOKENS,
+    GENERATION_TEMPERATURE
+)
+from lib.api_utils import RateLimiter, retry_openai
+
+# Size of the write buffer used for JSONL output files
+JSONL_WRITE_BUFFER_SIZE = 1024 * 1024
+# Datasets up to this many examples are written with a single write() call;
+# larger ones are written in chunks to keep memory bounded
+JSONL_SINGLE_WRITE_MAX_EXAMPLES = 50_000
+JSONL_WRITE_CHUNK_SIZE = 4096
+
+# Background thread for JSONL serialization, so writes don't block the script
+_JSONL_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jsonl-writer")
+# Writes serialized chunks of large JSONL files while the next chunk is being serialized
+_JSONL_CHUNK_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jsonl-chunk-writer")
+
+# Bytes of a memory-mapped file counted at a time in count_lines
+LINE_COUNT_WINDOW_SIZE = 16 * 1024 * 1024
+
+# Raw "content" string values in a JSONL file, matched without decoding the JSON
+_RE_JSONL_CONTENT = re.compile(rb'"content"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+# Seconds a cached path_exists result stays valid
+EXISTS_CACHE_TTL_SECONDS = 30
+
+# Shared by all sessions, so concurrent generations stay under the account's limits
+_GENERATION_RATE_LIMITER = RateLimiter(GENERATION_REQUESTS_PER_MINUTE, GENERATION_TOKENS_PER_MINUTE)
+
+
+# Fonts and styles injected by apply_custom_css
+_CUSTOM_CSS = """
     <link rel="preconnect" href="https://fonts.googleapis.com">
     <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=Space+Grotesk:wght@300..700&display=swap" rel="stylesheet">
@@ -88,7 +103,129 @@ def apply_custom_css():
             margin: 1rem 0;
         }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+
+def get_api_key() -> str:
+    """
+    Get OpenAI API key from session state or environment.
+
+    Returns:
+        API key string or None if not found
+    """
+    # Check session state first
+    if 'openai_api_key' in st.session_state and st.session_state.openai_api_key:
+        return st.session_state.openai_api_key
+
+    # Fall back to environment variable
+    return os.getenv('OPENAI_API_KEY')
+
+
+def get_openai_client() -> "OpenAI":
+    """
+    Get an OpenAI client using the API key from session state or environment.
+
+    Clients are cached per API key, so reruns and sessions reuse the same
+    client and its open HTTP connections.
+
+    Returns:
+        OpenAI client instance
+
+    Raises:
+        ValueError if no API key is found
+    """
+    api_key = get_api_key()
+    if not api_key:
+        raise ValueError("No OpenAI API key found. Please enter your API key.")
+
+    return _create_openai_client(api_key)
+
+
+@st.cache_resource(show_spinner=False)
+def _create_openai_client(api_key: str) -> "OpenAI":
+    """Create one shared OpenAI client per API key."""
+    # Imported here so the app can start without loading the OpenAI SDK
+    from openai import OpenAI, DefaultHttpxClient
+
+    # Multiplex concurrent requests over one HTTP/2 connection when the optional
+    # h2 package is installed. DefaultHttpxClient keeps the SDK's default
+    # timeouts and connection pool limits.
+    http_client = DefaultHttpxClient(http2=True) if importlib.util.find_spec("h2") else None
+    # retry_openai is the retry policy, so turn off the SDK's own retries
+    return OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+
+
+def path_exists(path: str, ttl: float = EXISTS_CACHE_TTL_SECONDS) -> bool:
+    """
+    Check whether a file exists, caching the result in session state for ttl seconds.
+
+    Call invalidate_path_cache after creating or deleting the file so the
+    change is seen immediately.
+
+    Args:
+        path: Path to check
+        ttl: Seconds before the file system is checked again
+
+    Returns:
+        True if the file exists
+    """
+    key = f"_exists::{path}"
+    now = time.monotonic()
+    cached = st.session_state.get(key)
+    if cached and now - cached[0] < ttl:
+        return cached[1]
+
+    exists = os.path.exists(path)
+    st.session_state[key] = (now, exists)
+    return exists
+
+
+def invalidate_path_cache(*paths: str):
+    """Forget cached path_exists results for the given paths."""
+    for path in paths:
+        st.session_state.pop(f"_exists::{path}", None)
+
+
+def count_lines(path: str) -> int:
+    """
+    Count the lines in a file, re-reading it only when it has changed.
+
+    Args:
+        path: Path to the file
+
+    Returns:
+        Number of lines in the file
+    """
+    stat = os.stat(path)
+    return _count_lines(path, stat.st_mtime_ns, stat.st_size)
+
+
+@st.cache_data(show_spinner=False)
+def _count_lines(path: str, mtime_ns: int, size: int) -> int:
+    """Count lines by memory-mapping the file and counting newlines (cached per path, mtime and size)."""
+    with open(path, "rb") as f:
+        # Empty files can't be memory-mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # mmap has no count(); count newlines in bounded slices so the whole
+            # file is never copied into memory at once
+            count = sum(
+                mm[i:i + LINE_COUNT_WINDOW_SIZE].count(b"\n")
+                for i in range(0, len(mm), LINE_COUNT_WINDOW_SIZE)
+            )
+            # A final line without a trailing newline still counts
+            if mm[-1:] != b"\n":
+                count += 1
+    return count
+
+
+def apply_custom_css():
+    """Apply custom CSS styling to the Streamlit app."""
+    # Streamlit drops elements that aren't re-rendered, so the block is sent on
+    # every rerun; keeping it as a module constant avoids rebuilding it.
+    st.markdown(_CUSTOM_CSS, unsafe_allow_html=True)
 
 
 def estimate_tokens(text: str) -> int:
@@ -104,24 +241,32 @@ def estimate_tokens(text: str) -> int:
     return len(text) // 4
 
 
-def estimate_cost(examples: list[dict], enhancement_api_calls: int = 0) -> dict:
+def estimate_cost(examples: Iterable[dict], enhancement_api_calls: int = 0, used_batch_api: bool = False) -> dict:
     """
     Estimate the cost of fine-tuning based on the number of tokens.
 
     Args:
-        examples: List of training examples
+        examples: Training examples (any iterable, it is read once)
         enhancement_api_calls: Number of API calls made for prompt enhancement
+        used_batch_api: Whether prompt enhancement went through the Batch API
 
     Returns:
         Dictionary with cost breakdown
     """
-    total_tokens = 0
-    for example in examples:
-        for msg in example.get("messages", []):
-            total_tokens += estimate_tokens(msg.get("content", ""))
+    # Same 4-characters-per-token estimate as estimate_tokens, applied to the
+    # total length in a single pass
+    total_chars = sum(
+        len(msg["content"])
+        for example in examples
+        for msg in example.get("messages", ())
+        if "content" in msg
+    )
+    total_tokens = total_chars // 4
 
     training_cost = (total_tokens / 1000) * COST_PER_1K_TOKENS["training"]
     enhancement_cost = enhancement_api_calls * 0.02
+    if used_batch_api:
+        enhancement_cost *= BATCH_API_DISCOUNT
 
     return {
         "total_tokens": total_tokens,
@@ -131,47 +276,157 @@ def estimate_cost(examples: list[dict], enhancement_api_calls: int = 0) -> dict:
     }
 
 
-def split_dataset(examples: list[dict], val_ratio: float = VALIDATION_SPLIT_RATIO, seed: int = 42):
+def estimate_cost_from_jsonl(path: str) -> dict:
     """
-    Split dataset into training and validation sets.
+    Estimate the fine-tuning cost of a JSONL file, re-reading it only when it has changed.
 
     Args:
-        examples: List of all examples
-        val_ratio: Ratio of data to use for validation
-        seed: Random seed for reproducibility
+        path: Path to the JSONL file
 
     Returns:
-        Tuple of (training_examples, validation_examples)
+        Dictionary with cost breakdown (see estimate_cost)
     """
-    random.seed(seed)
-    shuffled = examples.copy()
-    random.shuffle(shuffled)
+    stat = os.stat(path)
+    return _estimate_cost_from_jsonl(path, stat.st_mtime_ns, stat.st_size)
 
-    total = len(shuffled)
-    val_count = int(total * val_ratio)
 
-    val_examples = shuffled[:val_count]
-    train_examples = shuffled[val_count:]
+@st.cache_data(show_spinner=False)
+def _estimate_cost_from_jsonl(path: str, mtime_ns: int, size: int) -> dict:
+    """
+    Sum the length of every "content" string in the memory-mapped file instead of parsing whole lines.
 
-    return train_examples, val_examples
+    Only the matched strings are decoded, so the character count matches
+    estimate_cost. Falls back to parsing the file with estimate_cost if no
+    content strings are found.
+    """
+    total_chars = 0
+    with open(path, "rb") as f:
+        # Empty files can't be memory-mapped
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                total_chars = sum(_json_string_length(m.group(1)) for m in _RE_JSONL_CONTENT.finditer(mm))
+
+    if not total_chars:
+        with open(path, "rb") as f:
+            return estimate_cost(json.loads(line) for line in f if line.strip())
+
+    total_tokens = total_chars // 4
+    training_cost = (total_tokens / 1000) * COST_PER_1K_TOKENS["training"]
+    return {
+        "total_tokens": total_tokens,
+        "training_cost_usd": training_cost,
+        "enhancement_cost_usd": 0.0,
+        "total_cost_usd": training_cost
+    }
 
 
-def write_jsonl(examples: list[dict], filepath: str):
+def _json_string_length(raw: bytes) -> int:
+    """Count the characters of a JSON string literal's raw (still escaped) UTF-8 contents."""
+    if b"\\" not in raw:
+        return len(raw.decode("utf-8"))
+    # Escape sequences need a real decode to count as one character each
+    quoted = b'"' + raw + b'"'
+    return len(orjson.loads(quoted) if orjson else json.loads(quoted))
+
+
+def dumps_jsonl_line(example: dict) -> bytes:
+    """Serialize one example as a UTF-8 JSONL line (uses orjson when installed)."""
+    if orjson:
+        return orjson.dumps(example) + b"\n"
+    return (json.dumps(example, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def write_jsonl(examples: Iterable[dict], filepath: str):
     """
     Write examples to JSONL file.
 
+    Typical datasets are serialized into one payload and written at once.
+    Very large datasets (or iterables of unknown length) are written in
+    chunks through a 1 MB write buffer, so memory stays bounded. Each chunk
+    is written on a background thread while the next one is serialized;
+    file writes release the GIL, so the two overlap.
+
+    Args:
+        examples: Examples to write (any iterable)
+        filepath: Path to output file
+    """
+    with open(filepath, 'wb', buffering=JSONL_WRITE_BUFFER_SIZE) as f:
+        if isinstance(examples, Sized) and len(examples) <= JSONL_SINGLE_WRITE_MAX_EXAMPLES:
+            f.write(b"".join(dumps_jsonl_line(example) for example in examples))
+            return
+
+        examples = iter(examples)
+        pending_write = None
+        while chunk := list(islice(examples, JSONL_WRITE_CHUNK_SIZE)):
+            data = b"".join(dumps_jsonl_line(example) for example in chunk)
+            # At most one chunk is in flight, which keeps the lines in order
+            if pending_write:
+                pending_write.result()
+            pending_write = _JSONL_CHUNK_WRITER.submit(f.write, data)
+
+        if pending_write:
+            pending_write.result()
+
+
+def write_jsonl_async(examples: Iterable[dict], filepath: str) -> Future:
+    """
+    Write examples to JSONL file on a background thread.
+
     Args:
-        examples: List of examples to write
+        examples: Examples to write (must not be modified until the write finishes)
         filepath: Path to output file
+
+    Returns:
+        Future that completes (or raises) when the file has been written
     """
-    with open(filepath, 'w', encoding='utf-8') as f:
-        for example in examples:
-            f.write(json.dumps(example, ensure_ascii=False) + '\n')
+    return _JSONL_WRITER.submit(write_jsonl, examples, filepath)
 
 
-def upload_file_to_openai(client: OpenAI, filepath: str, purpose: str) -> str:
+def split_and_write_jsonl(examples: list[dict], train_path: str, val_path: str,
+                          val_ratio: float = VALIDATION_SPLIT_RATIO,
+                          seed: int = 42) -> tuple[list[int], list[int], list[Future]]:
     """
-    Upload a file to OpenAI.
+    Split examples into training and validation JSONL files in one step.
+
+    Shuffles indices instead of the examples and hands each split to
+    write_jsonl as a list of references into the input, so the dataset is
+    never copied or shuffled itself. Produces the same split as
+    prepare_data.split_dataset for the same seed. Files are written in the
+    background; wait on the returned futures before using them.
+
+    Args:
+        examples: List of all examples
+        train_path: Path to the training output file
+        val_path: Path to the validation output file
+        val_ratio: Ratio of data to use for validation
+        seed: Random seed for reproducibility
+
+    Returns:
+        Tuple of (train_indices, val_indices, write_futures), where the
+        indices point into examples
+    """
+    # A local generator keeps the split reproducible without touching the
+    # global random state shared by concurrent sessions
+    rng = random.Random(seed)
+    indices = list(range(len(examples)))
+    rng.shuffle(indices)
+
+    val_count = int(len(examples) * val_ratio)
+    val_indices = indices[:val_count]
+    train_indices = indices[val_count:]
+
+    write_futures = [
+        write_jsonl_async([examples[i] for i in train_indices], train_path),
+        write_jsonl_async([examples[i] for i in val_indices], val_path),
+    ]
+
+    return train_indices, val_indices, write_futures
+
+
+@retry_openai(max_attempts=3, max_delay=20.0)
+def upload_file_to_openai(client: "OpenAI", filepath: str, purpose: str) -> str:
+    """
+    Upload a file to OpenAI, retrying on transient API errors.
 
     Args:
         client: OpenAI client instance
@@ -186,7 +441,7 @@ def upload_file_to_openai(client: OpenAI, filepath: str, purpose: str) -> str:
     return response.id
 
 
-def create_fine_tuning_job(client: OpenAI, training_file_id: str, validation_file_id: str = None,
+def create_fine_tuning_job(client: "OpenAI", training_file_id: str, validation_file_id: str = None,
                           base_model: str = None, suffix: str = None,
                           hyperparameters: dict = None) -> str:
     """
@@ -221,10 +476,14 @@ def create_fine_tuning_job(client: OpenAI, training_file_id: str, validation_fil
     return response.id
 
 
-def generate_email(client: OpenAI, model_id: str, prompt: str, max_tokens: int = 500) -> str:
+@retry_openai(max_attempts=3, max_delay=20.0)
+def generate_email(client: "OpenAI", model_id: str, prompt: str, max_tokens: int = GENERATION_MAX_TOKENS) -> str:
     """
     Generate an email using the specified model.
 
+    Requests are throttled to the configured requests/tokens per minute, and
+    transient API errors are retried with exponential backoff.
+
     Args:
         client: OpenAI client instance
         model_id: Model ID to use for generation
@@ -234,10 +493,71 @@ def generate_email(client: OpenAI, model_id: str, prompt: str, max_tokens: int =
     Returns:
         Generated email text
     """
+    _GENERATION_RATE_LIMITER.acquire(estimate_tokens(prompt) + max_tokens)
     response = client.chat.completions.create(
         model=model_id,
         messages=[{"role": "user", "content": prompt}],
         max_tokens=max_tokens,
-        temperature=0.7,
+        temperature=GENERATION_TEMPERATURE,
     )
     return response.choices[0].message.content
+
+
+def generate_email_stream(client: "OpenAI", model_id: str, prompt: str, max_tokens: int = GENERATION_MAX_TOKENS) -> Iterator[str]:
+    """
+    Generate an email with the specified model, yielding text as it arrives.
+
+    Args:
+        client: OpenAI client instance
+        model_id: Model ID to use for generation
+        prompt: User prompt
+        max_tokens: Maximum tokens in response
+
+    Yields:
+        Chunks of generated email text
+    """
+    _GENERATION_RATE_LIMITER.acquire(estimate_tokens(prompt) + max_tokens)
+    for chunk in _open_generation_stream(client, model_id, prompt, max_tokens):
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+@retry_openai(max_attempts=3, max_delay=20.0)
+def _open_generation_stream(client: "OpenAI", model_id: str, prompt: str, max_tokens: int):
+    """Start a streaming generation, retrying on transient API errors before any text arrives."""
+    return client.chat.completions.create(
+        model=model_id,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+        temperature=GENERATION_TEMPERATURE,
+        stream=True,
+    )
+
+
+def generate_emails(client: "OpenAI", model_id: str, prompts: list[str], max_tokens: int = GENERATION_MAX_TOKENS,
+                    max_concurrency: int = GENERATION_MAX_CONCURRENCY) -> list:
+    """
+    Generate emails for several prompts concurrently, one request per prompt.
+
+    Each prompt is sent on its own, as the model was trained, and requests
+    share the generation rate limiter.
+
+    Args:
+        client: OpenAI client instance
+        model_id: Model ID to use for generation
+        prompts: User prompts
+        max_tokens: Maximum tokens in each response
+        max_concurrency: Maximum number of requests in flight at once
+
+    Returns:
+        List with the generated email text, or the exception raised, for
+        each prompt in input order
+    """
+    def generate(prompt):
+        try:
+            return generate_email(client, model_id, prompt, max_tokens=max_tokens)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(prompts)))) as executor:
+        return list(executor.map(generate, prompts))
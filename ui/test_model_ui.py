@@ -5,12 +5,36 @@ Handles testing the fine-tuned model with custom prompts.
 """
 
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import streamlit as st
 
-from lib.config import MODEL_INFO_FILE, FINETUNING_BASE_MODEL
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
 
-from .shared import generate_email, get_openai_client
+from lib.config import MODEL_INFO_FILE, FINETUNING_BASE_MODEL, GENERATION_MAX_TOKENS, GENERATION_TEMPERATURE
+from lib.batch_api import (
+    BATCH_TERMINAL_STATUSES,
+    build_chat_request,
+    submit_batch,
+    retrieve_batch,
+    download_batch_results
+)
+
+from .shared import generate_email, generate_email_stream, generate_emails, get_openai_client
+
+# Seconds between automatic status refreshes while a batch evaluation is running
+BATCH_EVAL_REFRESH_SECONDS = 30
+
+
+@st.cache_data(show_spinner=False)
+def _load_model_info(mtime_ns: int) -> dict:
+    """Load the model info file (cached until the file is rewritten)."""
+    data = Path(MODEL_INFO_FILE).read_bytes()
+    return orjson.loads(data) if orjson else json.loads(data)
 
 
 def render():
@@ -18,15 +42,16 @@ def render():
     st.header("Test Your Model")
     st.markdown("Try out your fine-tuned email writing model.")
 
-    # Check if model exists
-    if not Path(MODEL_INFO_FILE).exists():
+    # Check if model exists (the stat also keys the model info cache)
+    try:
+        model_info_mtime_ns = os.stat(MODEL_INFO_FILE).st_mtime_ns
+    except FileNotFoundError:
         st.warning("No fine-tuned model found. Please complete fine-tuning first in the 'Fine-Tune Model' tab.")
         st.stop()
 
     # Load model info
     try:
-        with open(MODEL_INFO_FILE, 'r') as f:
-            model_info = json.load(f)
+        model_info = _load_model_info(model_info_mtime_ns)
 
         model_id = model_info.get("model_id")
         base_model = model_info.get("base_model", FINETUNING_BASE_MODEL)
@@ -44,6 +69,21 @@ def render():
 
         selected_example = st.selectbox("Choose an example prompt:", [""] + examples)
 
+        if st.button("Generate All Examples"):
+            try:
+                client = get_openai_client()
+                # Examples are generated concurrently, one request each
+                with st.spinner("Generating..."):
+                    example_emails = generate_emails(client, model_id, examples)
+                for example, email in zip(examples, example_emails):
+                    with st.expander(example, expanded=True):
+                        if isinstance(email, Exception):
+                            st.error(f"Error generating email: {email}")
+                        else:
+                            st.write(email)
+            except Exception as e:
+                st.error(f"Error generating emails: {e}")
+
         # Custom prompt
         st.subheader("Or Enter Your Own Prompt")
         prompt = st.text_area(
@@ -64,30 +104,133 @@ def render():
                 if compare_with_base:
                     col1, col2 = st.columns(2)
 
-                    with col1:
-                        st.markdown("### Fine-Tuned Model")
-                        with st.spinner("Generating..."):
-                            fine_tuned_response = generate_email(client, model_id, prompt)
-                        st.markdown("---")
-                        st.write(fine_tuned_response)
-
-                    with col2:
-                        st.markdown("### Base Model")
-                        with st.spinner("Generating..."):
-                            base_response = generate_email(client, base_model, prompt)
-                        st.markdown("---")
-                        st.write(base_response)
+                    # A pool per click keeps sessions from queueing behind each other,
+                    # and leaving the block waits for both requests even on a rerun
+                    with ThreadPoolExecutor(max_workers=2) as executor:
+                        # Start both requests before waiting on either
+                        fine_tuned_future = executor.submit(generate_email, client, model_id, prompt)
+                        base_future = executor.submit(generate_email, client, base_model, prompt)
+
+                        with col1:
+                            st.markdown("### Fine-Tuned Model")
+                            with st.spinner("Generating..."):
+                                fine_tuned_response = fine_tuned_future.result()
+                            st.markdown("---")
+                            st.write(fine_tuned_response)
+
+                        with col2:
+                            st.markdown("### Base Model")
+                            with st.spinner("Generating..."):
+                                base_response = base_future.result()
+                            st.markdown("---")
+                            st.write(base_response)
                 else:
-                    with st.spinner("Generating email..."):
-                        response = generate_email(client, model_id, prompt)
-
+                    # Stream the email so text appears as soon as the first tokens arrive
                     st.markdown("### Generated Email")
                     st.markdown("---")
-                    st.write(response)
+                    st.write_stream(generate_email_stream(client, model_id, prompt))
                     st.markdown("---")
 
             except Exception as e:
                 st.error(f"Error generating email: {e}")
 
+        render_batch_evaluation(model_id)
+
     except Exception as e:
         st.error(f"Error loading model info: {e}")
+
+
+def render_batch_evaluation(model_id: str):
+    """
+    Render the Batch API evaluation section.
+
+    Args:
+        model_id: Fine-tuned model ID
+    """
+    st.markdown("---")
+    st.subheader("Batch Evaluation")
+    st.markdown("Run many prompts through the OpenAI Batch API at half price. "
+                "Results usually arrive within minutes, but can take up to 24 hours.")
+
+    prompts_text = st.text_area(
+        "Prompts (one per line)",
+        placeholder="Write an email asking for a project update...\nWrite a short thank-you note...",
+        height=150
+    )
+    prompts = [line.strip() for line in prompts_text.splitlines() if line.strip()]
+
+    if st.button("Batch Evaluate", disabled=len(prompts) < 2, help="Enter at least two prompts"):
+        try:
+            client = get_openai_client()
+            # Same generation settings as generate_email
+            requests = [
+                build_chat_request(f"eval-{i}", {
+                    "model": model_id,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "max_tokens": GENERATION_MAX_TOKENS,
+                    "temperature": GENERATION_TEMPERATURE,
+                })
+                for i, prompt in enumerate(prompts)
+            ]
+            st.session_state.batch_evaluation = {
+                "batch_id": submit_batch(client, requests),
+                "prompts": prompts,
+                "status": None,
+                "results": None,
+            }
+        except Exception as e:
+            st.error(f"Error submitting batch: {e}")
+
+    batch_evaluation = st.session_state.get("batch_evaluation")
+    if batch_evaluation:
+        # Only keep polling while results are outstanding
+        finished = batch_evaluation["results"] is not None
+        monitor = st.fragment(_show_batch_evaluation, run_every=None if finished else BATCH_EVAL_REFRESH_SECONDS)
+        monitor(batch_evaluation)
+
+
+def _show_batch_evaluation(batch_evaluation: dict):
+    """
+    Show the status or results of a batch evaluation.
+
+    Runs as a fragment, so periodic refreshes only re-run this function
+    rather than the whole app.
+
+    Args:
+        batch_evaluation: Session state entry with batch_id, prompts and results
+    """
+    if batch_evaluation["results"] is None:
+        try:
+            client = get_openai_client()
+            batch = retrieve_batch(client, batch_evaluation["batch_id"])
+        except Exception as e:
+            st.error(f"Error checking batch: {e}")
+            return
+
+        if batch.status not in BATCH_TERMINAL_STATUSES:
+            counts = batch.request_counts
+            progress = f" ({counts.completed}/{counts.total} requests)" if counts else ""
+            st.info(f"Batch {batch.id}: {batch.status}{progress}. "
+                    f"Status refreshes every {BATCH_EVAL_REFRESH_SECONDS} seconds.")
+            return
+
+        # Store results and rerun the whole app once so polling stops
+        batch_evaluation["status"] = batch.status
+        if batch.status == "completed":
+            try:
+                batch_evaluation["results"] = download_batch_results(client, batch)
+            except Exception as e:
+                st.error(f"Error downloading results: {e}")
+                return
+        else:
+            batch_evaluation["results"] = {}
+        st.rerun()
+
+    if batch_evaluation["status"] != "completed":
+        st.error(f"Batch {batch_evaluation['batch_id']} ended with status: {batch_evaluation['status']}")
+        return
+
+    results = batch_evaluation["results"]
+    for i, prompt in enumerate(batch_evaluation["prompts"]):
+        with st.expander(prompt, expanded=i == 0):
+            st.write(results.get(f"eval-{i}", "⚠️ This request failed."))